@@ -0,0 +1,2 @@
+# Use BatteryConfig (apps.py) which connects the signal receivers
+default_app_config = 'battery.apps.BatteryConfig'
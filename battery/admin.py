@@ -1,29 +1,83 @@
 from django.contrib import admin
+from django.db.models.functions import Now
 
 # Register your models here.
 
 from .models import *
+from .pagination import EstimatedCountPaginator
+from .cache import invalidate_inventory
+from .queries import refresh_assigned_qty
+
+# The changelists must run a constant nb of queries whatever the nb of rows:
+# - list_select_related: the __str__ of a Device shows its battery type, the __str__ of a BatteryAssignment
+#   shows its device: follow these keys in the query of the changelist
+# - no list_filter on the users or on the foreign keys: the sidebar would load every user/object of all users.
+#   The users are found with the search box (email) and the filters are on the distinct values of a column
+# - autocomplete_fields/raw_id_fields: the change forms do not load every object in the dropdowns
+# - show_full_result_count = False and EstimatedCountPaginator: no COUNT(*) of the whole table
+
+
+def invalidate_users(queryset):
+    # The bulk actions do not send the signals which evict the cached data of the users
+    for user_id in queryset.order_by().values_list('user_id', flat=True).distinct():
+        invalidate_inventory(user_id)
+
+
+class BatteryAdmin(admin.ModelAdmin):
+    # Settings shared by the admin of the battery models
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ("user", )
+    list_per_page = 100
 
 
 @admin.register(BatteryType)
-class BatteryTypeAdmin(admin.ModelAdmin):
+class BatteryTypeAdmin(BatteryAdmin):
     list_display = ("type", "description", "user")
-    list_filter = ("user", )
+    list_select_related = ("user", )
+    list_filter = ("type", )
+    search_fields = ("type", "description", "user__email")
 
 
 @admin.register(BatteryModel)
-class BatteryModelAdmin(admin.ModelAdmin):
+class BatteryModelAdmin(BatteryAdmin):
     list_display = ("description", "user")
-    list_filter = ("user", )
+    list_select_related = ("user", )
+    search_fields = ("description", "user__email")
 
 
 @admin.register(Device)
-class DeviceAdmin(admin.ModelAdmin):
-    list_display = ("description", "battery_type", "battery_qty", "user")
-    list_filter = ("user", "battery_type",)
+class DeviceAdmin(BatteryAdmin):
+    list_display = ("description", "battery_type", "battery_qty", "assigned_qty", "user")
+    list_select_related = ("battery_type", "user")
+    list_filter = ("battery_type__type", )
+    search_fields = ("description", "user__email")
+    autocomplete_fields = ("battery_type", )
+    actions = ("recompute_assigned_qty", )
+
+    def recompute_assigned_qty(self, request, queryset):
+        # One UPDATE for all the selected devices
+        updated = refresh_assigned_qty(queryset)
+        invalidate_users(queryset)
+        self.message_user(request, f"{updated} devices updated.")
+    recompute_assigned_qty.short_description = "Recompute the nb of assigned batteries"
 
 
 @admin.register(BatteryAssignment)
-class BatteryAssignmentAdmin(admin.ModelAdmin):
+class BatteryAssignmentAdmin(BatteryAdmin):
     list_display = ("device", "battery_model", "battery_qty", "user")
-    list_filter = ("user", "battery_model",)
+    list_select_related = ("device__battery_type", "battery_model", "user")
+    list_filter = ("battery_model__description", )
+    search_fields = ("device__description", "battery_model__description", "user__email")
+    autocomplete_fields = ("device", "battery_model")
+    actions = ("set_battery_qty_to_one", )
+
+    def set_battery_qty_to_one(self, request, queryset):
+        # One UPDATE for all the selected assignments (1 battery never exceeds the capacity of a device),
+        # then one UPDATE of the counters of their devices since queryset.update() does not send signals
+        device_ids = set(queryset.values_list('device_id', flat=True))
+        updated = queryset.update(battery_qty=1, updated_at=Now())
+        refresh_assigned_qty(Device.objects.filter(pk__in=device_ids))
+        invalidate_users(queryset)
+        self.message_user(request, f"{updated} assignments updated.")
+    set_battery_qty_to_one.short_description = "Set the nb of batteries to 1"
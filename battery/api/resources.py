@@ -0,0 +1,193 @@
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import F, Func
+
+from battery.cache import invalidate_choices
+from battery.forms import capacity_error
+from battery.models import BatteryType, BatteryModel, Device, BatteryAssignment
+from battery.queries import refresh_assigned_qty
+
+#
+# Resources of the JSON API: one class per model
+#
+# The objects of a bulk request are validated all together, with a constant nb of queries:
+# - the fields are validated with the validators of the model (Model.full_clean()) without the foreign keys
+# - the foreign keys are validated against the primary keys of the user's objects, loaded once per request
+# - the battery capacity of the devices is validated against Device.assigned_qty, with the same rule as
+#   BatteryAssignmentForm.clean_battery_qty()
+#
+# bulk_create() and bulk_update() do not send the signals of battery/signals.py: after_write() does their job, and
+# the views update the cached inventory and the search entries
+#
+
+
+class CollateC(Func):
+    # Compare and sort by the code points of the text, whatever the collation of the DB (COLLATE was only added
+    # to Django in 3.2)
+    template = '%(expressions)s COLLATE "C"'
+
+
+class Resource:
+    model = None
+    fields = ()             # fields which can be written through the API
+    read_only_fields = ()   # fields which are only returned
+    foreign_keys = {}       # field -> model of the user's objects it references
+    search_field = None     # field searched by the typeahead of the forms (indexed with the user)
+
+    def __init__(self, user):
+        self.user = user
+        self._related_pks = {}
+
+    def queryset(self):
+        # The foreign keys are returned as primary keys: no join
+        return self.model.objects.for_user(self.user).select_related(None)
+
+    def search(self, text, size):
+        # Return the first 'size' objects whose search_field starts with 'text', then contains it, as a list of
+        # {'id', 'label'} where the label is str() of the object
+        # The prefix is searched with a range on the (user, search_field) index: LIKE cannot use it (LIKE is
+        # case-insensitive on SQLite, and needs a pattern_ops index on PostgreSQL). The range is case-sensitive:
+        # the other cases are found by the substring search, which scans the objects of the user
+        # The upper bound '\U0010ffff' sorts after all the texts starting with 'text' only in the order of the code
+        # points: on PostgreSQL, whose collations follow the language, the range is compared with COLLATE "C", on
+        # the (user_id, search_field COLLATE "C") index (see the migration 0013_search_collate_c)
+        queryset = self.model.objects.for_user(self.user).order_by(self.search_field, 'pk')
+        key = F(self.search_field)
+        if connection.vendor == 'postgresql':
+            key = CollateC(key)
+        prefixed = queryset.annotate(search_key=key).order_by('search_key', 'pk')
+        found = list(prefixed.filter(search_key__gte=text, search_key__lt=text + '\U0010ffff')[:size])
+        if text and len(found) < size:
+            found += queryset.filter(**{f'{self.search_field}__icontains': text}).exclude(
+                pk__in=[instance.pk for instance in found])[:size - len(found)]
+        return [{'id': instance.pk, 'label': str(instance)} for instance in found]
+
+    def serialize(self, instance):
+        # Return the instance as a dict, the foreign keys are returned as primary keys
+        data = {'id': instance.pk}
+        for name in self.fields + self.read_only_fields:
+            data[name] = getattr(instance, f'{name}_id' if name in self.foreign_keys else name)
+        return data
+
+    def related_pks(self, name):
+        # Primary keys of the user's objects which can be referenced by the foreign key 'name' (one query)
+        if name not in self._related_pks:
+            self._related_pks[name] = set(
+                self.foreign_keys[name].objects.for_user(self.user).values_list('pk', flat=True))
+        return self._related_pks[name]
+
+    def build(self, data, instance=None):
+        # Set the fields of 'data' (a dict) on the instance (a new one if None) and validate them
+        # Raise a ValidationError with the errors of each field
+        if not isinstance(data, dict):
+            raise ValidationError("Expected an object")
+        if instance is None:
+            instance = self.model(user=self.user)
+            missing = [name for name in self.fields if name not in data and self.required(name)]
+            if missing:
+                raise ValidationError({name: ["This field is required."] for name in missing})
+
+        errors = {}
+        for name in self.fields:
+            if name not in data:
+                continue
+            if name in self.foreign_keys:
+                pk = data[name]
+                if not isinstance(pk, int) or isinstance(pk, bool) or pk not in self.related_pks(name):
+                    errors[name] = [f"Unknown {name} {data[name]!r}."]
+                setattr(instance, f'{name}_id', data[name])
+            else:
+                setattr(instance, name, data[name])
+        try:
+            # The foreign keys were validated above, without one query per object
+            instance.full_clean(exclude=list(self.foreign_keys) + ['user'], validate_unique=False)
+        except ValidationError as e:
+            errors.update(e.message_dict)
+        if errors:
+            raise ValidationError(errors)
+        return instance
+
+    def required(self, name):
+        field = self.model._meta.get_field(name)
+        return not field.blank and not field.has_default()
+
+    def check(self, instances, errors):
+        # Validation rules involving several objects. Add the errors to 'errors' (index -> errors)
+        pass
+
+    def after_write(self, instances, previous=()):
+        # Called in the transaction after the instances were created/updated/deleted
+        # 'previous' are the (device_id, battery_qty) counted before an update or a delete (assignments only)
+        pass
+
+
+class BatteryTypeResource(Resource):
+    model = BatteryType
+    fields = ('type', 'description')
+
+    def after_write(self, instances, previous=()):
+        invalidate_choices(BatteryType, self.user.pk)
+        invalidate_choices(Device, self.user.pk)    # the label of a Device shows its battery type
+
+
+class BatteryModelResource(Resource):
+    model = BatteryModel
+    fields = ('description',)
+    search_field = 'description'
+
+    def after_write(self, instances, previous=()):
+        invalidate_choices(BatteryModel, self.user.pk)
+
+
+class DeviceResource(Resource):
+    model = Device
+    fields = ('description', 'battery_type', 'battery_qty')
+    read_only_fields = ('assigned_qty',)
+    foreign_keys = {'battery_type': BatteryType}
+    search_field = 'description'
+
+    def after_write(self, instances, previous=()):
+        invalidate_choices(Device, self.user.pk)
+
+
+class BatteryAssignmentResource(Resource):
+    model = BatteryAssignment
+    fields = ('device', 'battery_model', 'battery_qty')
+    foreign_keys = {'device': Device, 'battery_model': BatteryModel}
+
+    def check(self, instances, errors):
+        # The total nb of batteries assigned to a device must be no greater than the battery capacity of the device
+        # (same rule as BatteryAssignmentForm.clean_battery_qty()).
+        # The rows of the devices are locked until the end of the transaction (see clean_battery_qty())
+        devices = Device.objects.for_user(self.user).filter(pk__in={instance.device_id for instance in instances})
+        if connection.features.has_select_for_update:
+            devices = devices.select_for_update()
+        capacity = {pk: (battery_qty, assigned_qty)
+                    for pk, battery_qty, assigned_qty in devices.values_list('pk', 'battery_qty', 'assigned_qty')}
+        assigned = {pk: assigned_qty for pk, (battery_qty, assigned_qty) in capacity.items()}
+
+        # The updated assignments are not counted with their previous battery_qty
+        for instance in instances:
+            if instance._counted and instance._counted[0] in assigned:
+                assigned[instance._counted[0]] -= instance._counted[1]
+
+        for index, instance in enumerate(instances):
+            battery_capacity = capacity[instance.device_id][0]
+            rest = battery_capacity - assigned[instance.device_id]
+            if 1 <= instance.battery_qty <= rest:
+                assigned[instance.device_id] += instance.battery_qty
+            else:
+                errors[index] = {'battery_qty': capacity_error(rest).messages}
+
+    def after_write(self, instances, previous=()):
+        # Rebuild the counters of the devices whose assignments changed
+        device_ids = {instance.device_id for instance in instances} | {device_id for device_id, qty in previous}
+        refresh_assigned_qty(Device.objects.filter(pk__in=device_ids))
+
+
+RESOURCES = {
+    'types': BatteryTypeResource,
+    'models': BatteryModelResource,
+    'devices': DeviceResource,
+    'assignments': BatteryAssignmentResource,
+}
@@ -0,0 +1,16 @@
+from django.urls import path
+
+from battery.api import views
+
+# Referenced in the templates and views with {% url 'battery:api:<path.name>' %}
+app_name = 'api'
+
+urlpatterns = [
+    path('types', views.collection, {'resource': 'types'}, name='types'),
+    path('models', views.collection, {'resource': 'models'}, name='models'),
+    path('devices', views.collection, {'resource': 'devices'}, name='devices'),
+    path('assignments', views.collection, {'resource': 'assignments'}, name='assignments'),
+    path('summary', views.summary, name='summary'),
+    path('models/search', views.search, {'resource': 'models'}, name='model_search'),
+    path('devices/search', views.search, {'resource': 'devices'}, name='device_search'),
+]
@@ -0,0 +1,183 @@
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+
+from battery.api.resources import RESOURCES
+from battery.cache import get_summary, invalidate_inventory
+from battery.pagination import paginate
+from battery.search import index_new, reindex
+
+#
+# JSON API
+#
+# One URL per resource (types, models, devices, assignments) which accepts:
+# - GET    : list the objects of the user, by pages of 'size' objects ordered by id (keyset pagination with 'after')
+# - POST   : create an object, or all the objects of an array
+# - PATCH  : update the objects of an array, each object must contain its 'id' and the fields to update
+# - DELETE : delete the objects whose ids are given in an array
+# and a read-only overview of the inventory ('summary', see battery.queries.inventory_summary())
+# The models and devices can be searched by their description with '<resource>/search?q=<text>': the first
+# BATTERY_TYPEAHEAD_SIZE matches, used by the typeahead of the forms (see battery.forms.TypeaheadSelect)
+#
+# A bulk request is validated as a whole and written in one transaction with bulk_create()/bulk_update():
+# if any object is not valid nothing is written and the errors are returned with their index in the array.
+#
+# The API uses the session of the user: clients log in through the login page, then send the CSRF token
+# in the 'X-CSRFToken' header of the POST/PATCH/DELETE requests.
+#
+
+
+def api_login_required(view):
+    # Like login_required but reply with '401 Unauthorized' instead of redirecting to the login page
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': "Authentication required"}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _load_json(request):
+    # Return the JSON body of the request, as a list of objects
+    data = json.loads(request.body)
+    return data if isinstance(data, list) else [data]
+
+
+@api_login_required
+def collection(request, resource):
+    resource = RESOURCES[resource](request.user)
+
+    if request.method == 'GET':
+        return _list(request, resource)
+    elif request.method not in ('POST', 'PATCH', 'DELETE'):
+        return JsonResponse({'error': f"Method {request.method} not allowed"}, status=405)
+
+    try:
+        data = _load_json(request)
+    except ValueError:
+        return JsonResponse({'error': "The body of the request must be JSON"}, status=400)
+
+    if request.method == 'POST':
+        return _create(resource, data)
+    elif request.method == 'PATCH':
+        return _update(resource, data)
+    else:
+        return _delete(resource, data)
+
+
+@api_login_required
+def summary(request):
+    if request.method != 'GET':
+        return JsonResponse({'error': f"Method {request.method} not allowed"}, status=405)
+    return JsonResponse(get_summary(request.user))
+
+
+@api_login_required
+def search(request, resource):
+    if request.method != 'GET':
+        return JsonResponse({'error': f"Method {request.method} not allowed"}, status=405)
+    resource = RESOURCES[resource](request.user)
+    text = request.GET.get('q', '').strip()
+    return JsonResponse({'results': resource.search(text, settings.BATTERY_TYPEAHEAD_SIZE)})
+
+
+def _list(request, resource):
+    page = paginate(request, resource.queryset())
+    results = [resource.serialize(instance) for instance in page]
+    next_url = None
+    if page.has_next and results:
+        next_url = f"{reverse(request.resolver_match.view_name)}?size={page.size}&after={results[-1]['id']}"
+    return JsonResponse({'results': results, 'next': next_url})
+
+
+def _validate(resource, data, instances=None):
+    # Build and validate the instances from the list of objects 'data'
+    # 'instances' are the existing instances being updated (one per object), None for a creation
+    # Return the list of instances and a dict of the errors (index -> errors)
+    built, errors = [], {}
+    for index, obj in enumerate(data):
+        try:
+            built.append(resource.build(obj, instances[index] if instances else None))
+        except ValidationError as e:
+            errors[index] = e.message_dict if hasattr(e, 'error_dict') else {'__all__': e.messages}
+    if not errors:
+        resource.check(built, errors)
+    return built, errors
+
+
+def _errors(errors):
+    return JsonResponse({'errors': errors}, status=400)
+
+
+def _create(resource, data):
+    with transaction.atomic():
+        instances, errors = _validate(resource, data)
+        if errors:
+            return _errors(errors)
+        resource.model.objects.bulk_create(instances, batch_size=1000)
+        resource.after_write(instances)
+        invalidate_inventory(resource.user.pk)
+        # The primary keys of the new objects may not be known: index the objects of the user which are not yet
+        index_new([resource.user.pk])
+
+    response = {'created': len(instances)}
+    # The primary keys of the new objects are only known on the DB backends which return them (e.g., PostgreSQL)
+    if connection.features.can_return_rows_from_bulk_insert:
+        response['ids'] = [instance.pk for instance in instances]
+    return JsonResponse(response, status=201)
+
+
+def _get_ids(data):
+    # Return the ids of the list of objects (PATCH) or ids (DELETE), None if any is not valid
+    ids = [obj.get('id') if isinstance(obj, dict) else obj for obj in data]
+    return ids if all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids) else None
+
+
+def _update(resource, data):
+    if not all(isinstance(obj, dict) for obj in data):
+        return _errors({'__all__': ["Expected an array of objects"]})
+    ids = _get_ids(data)
+    if ids is None or len(set(ids)) != len(ids):
+        return _errors({'__all__': ["Each object must have a distinct integer 'id'"]})
+
+    with transaction.atomic():
+        # Load all the instances to update in one query
+        existing = resource.queryset().in_bulk(ids)
+        missing = {index: {'id': [f"Unknown id {pk}."]} for index, pk in enumerate(ids) if pk not in existing}
+        if missing:
+            return _errors(missing)
+
+        instances = [existing[pk] for pk in ids]
+        previous = [getattr(instance, '_counted', None) for instance in instances]
+        updates = [{name: value for name, value in obj.items() if name != 'id'} for obj in data]
+        instances, errors = _validate(resource, updates, instances)
+        if errors:
+            return _errors(errors)
+        # bulk_update() does not set the auto_now fields
+        now = timezone.now()
+        for instance in instances:
+            instance.updated_at = now
+        resource.model.objects.bulk_update(instances, resource.fields + ('updated_at',), batch_size=1000)
+        resource.after_write(instances, previous=[counted for counted in previous if counted])
+        invalidate_inventory(resource.user.pk)
+        reindex(resource.model, ids)
+
+    return JsonResponse({'updated': len(instances)})
+
+
+def _delete(resource, data):
+    ids = _get_ids(data)
+    if ids is None:
+        return _errors({'__all__': ["Expected an array of integer ids"]})
+
+    with transaction.atomic():
+        # The deletion sends the signals which maintain the counters and the caches (see battery/signals.py)
+        deleted, per_model = resource.queryset().filter(pk__in=ids).delete()
+
+    return JsonResponse({'deleted': per_model.get(resource.model._meta.label, 0)})
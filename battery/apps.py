@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BatteryConfig(AppConfig):
     name = 'battery'
+
+    def ready(self):
+        # Connect the signal receivers
+        from battery import signals
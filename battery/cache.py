@@ -0,0 +1,111 @@
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+
+from battery.queries import inventory_summary
+from battery.routers import read_primary, reading_replica
+
+#
+# Per-user caches, stored with the Django cache framework (see CACHES in settings.py)
+#
+# The cached data is evicted by the signal receivers in battery/signals.py when the user's data changes.
+# Bulk operations which do not send signals must call the invalidate_*() functions themselves.
+# The data is cached from the primary DB, never from the read replica: the lag of the replica would be cached with
+# it, until the timeout (see battery/routers.py).
+#
+
+
+def _choices_key(model, user_id):
+    return f'battery:choices:{model._meta.model_name}:{user_id}'
+
+
+def get_choices(model, user):
+    # Return the list of (id, label) of all the instances of 'model' (BatteryType, BatteryModel, Device)
+    # for the user, as used to build the choices of a <select>
+    # The foreign keys followed by the label (str()) of the instances are joined by for_user()
+    key = _choices_key(model, user.pk)
+    choices = cache.get(key)
+    if choices is None:
+        read_primary()
+        queryset = model.objects.for_user(user)
+        choices = [(o.id, str(o)) for o in queryset]
+        cache.set(key, choices, settings.BATTERY_CHOICES_CACHE_TIMEOUT)
+    return choices
+
+
+def invalidate_choices(model, user_id):
+    key = _choices_key(model, user_id)
+    cache.delete(key)
+    # A request which reads the choices before the transaction is committed could cache the previous ones again:
+    # evict them once more after the commit (see invalidate_inventory())
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def _summary_key(user_id):
+    return f'battery:summary:{user_id}'
+
+
+def get_summary(user):
+    # Return the overview of the inventory of the user (see battery.queries.inventory_summary())
+    key = _summary_key(user.pk)
+    summary = cache.get(key)
+    if summary is None:
+        read_primary()
+        summary = inventory_summary(user)
+        cache.set(key, summary, settings.BATTERY_SUMMARY_CACHE_TIMEOUT)
+    return summary
+
+
+def _version_key(user_id):
+    return f'battery:version:{user_id}'
+
+
+def inventory_version(user_id):
+    # Return the version of the inventory of the user, which changes whenever any of its rows changes
+    # The fragments of templates rendered from the inventory are cached under this version (see table_cache())
+    # The initial version is the current time so that a version evicted from the cache is never reused
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def table_cache(request, name):
+    # Arguments of the {% cache %} tags of the index page of 'name' (type, model, device, assignment): the fragments
+    # 'battery_<name>_headline' and 'battery_<name>_table' are cached per user, GET parameters (filters, page, size)
+    # and version of the inventory
+    # The CSRF token sent by the filter forms changes on every render: it is not part of the key
+    params = sorted((param, value) for param, values in request.GET.lists() if param != 'csrfmiddlewaretoken'
+                    for value in values)
+    arguments = {'timeout': settings.BATTERY_TABLE_CACHE_TIMEOUT, 'user': request.user.pk,
+                 'params': urlencode(params), 'version': inventory_version(request.user.pk)}
+    if reading_replica():
+        # The fragments which are not cached are rendered from the primary
+        vary_on = [arguments['user'], arguments['params'], arguments['version']]
+        keys = [make_template_fragment_key(f'battery_{name}_{fragment}', vary_on)
+                for fragment in ('headline', 'table')]
+        if len(cache.get_many(keys)) < len(keys):
+            read_primary()
+    return arguments
+
+
+def _evict_inventory(user_id):
+    cache.delete(_summary_key(user_id))
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:  # no version in the cache: the next one will be new
+        pass
+
+
+def invalidate_inventory(user_id):
+    # Evict the data cached from the whole inventory of the user, when any of its rows changes
+    _evict_inventory(user_id)
+    # A request which reads the inventory before the transaction is committed could cache the previous data
+    # again: evict it once more after the commit
+    transaction.on_commit(lambda: _evict_inventory(user_id))
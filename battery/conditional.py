@@ -0,0 +1,53 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from battery.queries import inventory_fingerprint
+
+#
+# Conditional GET of the battery pages (ETag and Last-Modified)
+#
+# The pages of a user only depend on the inventory of this user: the ETag is computed from the nb of rows and the
+# time of the last change of each table of the inventory (one query, see inventory_fingerprint()).
+# When the browser or a poller sends back the ETag of an unchanged page, the view replies '304 Not Modified'
+# without running the view nor rendering the template.
+#
+# The ETag also covers the CSRF cookie: the forms of a page reused from the browser cache hold a token derived
+# from it. Last-Modified cannot see the deletions: the clients which send both headers (all the browsers)
+# are answered from the ETag.
+#
+
+
+def _fingerprint(request):
+    # The ETag and the Last-Modified functions are both called for a request: run the query once
+    if not hasattr(request, '_battery_fingerprint'):
+        request._battery_fingerprint = inventory_fingerprint(request.user)
+    return request._battery_fingerprint
+
+
+def _etag(request, *args, **kwargs):
+    fingerprint, last_modified = _fingerprint(request)
+    data = f'{request.user.pk}:{fingerprint}:{request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")}'
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def _last_modified(request, *args, **kwargs):
+    return _fingerprint(request)[1]
+
+
+def inventory_condition(view):
+    # Decorator of the views which render the inventory of the logged-in user (must be used under login_required)
+    # The responses are stored by the browser but always revalidated: private (per user) and no-cache
+    # The other methods (POST of the forms) are not conditional: no fingerprint query for them
+    conditional_view = cache_control(private=True, no_cache=True)(
+        condition(etag_func=_etag, last_modified_func=_last_modified)(view))
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return conditional_view(request, *args, **kwargs)
+        return view(request, *args, **kwargs)
+    return wrapper
@@ -1,12 +1,47 @@
 from crispy_forms.helper import FormHelper
 from django import forms
 from django.forms import ModelForm
-from django.db.models import Sum
+from django.db import connection
+from django.urls import reverse_lazy
 
 from battery import models
+from battery.cache import get_choices
 from battery.models import BatteryType, BatteryModel, BatteryAssignment, Device
 
 
+def capacity_error(rest):
+    # Error reported when more batteries than the 'rest' of the capacity of a device are assigned to it
+    battery_ies = "batteries" if rest > 1 else "battery"
+    return forms.ValidationError(f"No more than {rest} {battery_ies} can be assigned to this device.",
+                                 code='incorrect_value')
+
+
+def set_cached_choices(field, model, user):
+    # Render a ModelChoiceField with the cached choices of the user (see battery/cache.py) instead of
+    # running its queryset (and str() of each instance) every time the form is rendered.
+    # The queryset of the field must be set before: it is still used to validate the submitted value
+    field.choices = [('', field.empty_label)] + get_choices(model, user)
+
+
+class TypeaheadSelect(forms.Select):
+    # <select> of a ModelChoiceField which is searched as the user types instead of listing all the objects of
+    # the user: only the empty choice and the selected object are rendered, the script in static/js/base.js adds
+    # a search box which fills the options with the matches of the JSON API ('url', see battery.api.views.search)
+
+    def __init__(self, url, attrs=None):
+        super().__init__(attrs={'data-typeahead-url': url, **(attrs or {})})
+
+    def optgroups(self, name, value, attrs=None):
+        # self.choices is the ModelChoiceIterator of the field: only query the selected object (edit form)
+        iterator = self.choices
+        selected = iterator.queryset.filter(pk__in=[pk for pk in value if str(pk).isdigit()])
+        self.choices = [('', iterator.field.empty_label)] + [iterator.choice(instance) for instance in selected]
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = iterator
+
+
 #
 # Form based on the model defined in models.py
 #
@@ -17,49 +52,55 @@ class BatteryAssignmentForm(ModelForm):
     class Meta:
         model = BatteryAssignment
         fields = ['device', 'battery_model', 'battery_qty']
+        # A user may have thousands of devices: they are searched instead of being rendered as options
+        widgets = {
+            'device': TypeaheadSelect(reverse_lazy('battery:api:device_search')),
+            'battery_model': TypeaheadSelect(reverse_lazy('battery:api:model_search')),
+        }
 
     def __init__(self, user, *args, **kwargs):
         super(BatteryAssignmentForm, self).__init__(*args, **kwargs)
         # For the foreign keys: Only show the Devices and battery models associated for this user
         self.user = user
-        self.fields['device'].queryset = models.Device.objects.filter(user=user)
-        self.fields['battery_model'].queryset = models.BatteryModel.objects.filter(user=user)
+        self.fields['device'].queryset = models.Device.objects.for_user(user)
+        self.fields['battery_model'].queryset = models.BatteryModel.objects.for_user(user)
 
     # Validator for battery_qty
     def clean_battery_qty(self):
         # The total nb of batteries assigned to a device must be no greater than the battery capacity of the device
+        device = self.cleaned_data.get('device')
+        if device is None:  # the device is not valid, an error is already reported for the 'device' field
+            return self.cleaned_data['battery_qty']
 
-        # Retrieve the battery capacity of the Device to which batteries are assigned
-        dev = Device.objects.get(user=self.user, description=self.cleaned_data['device'].description)
-        battery_capacity = dev.battery_qty  # Battery capacity for this Device
+        # The Device is retrieved by primary key (the description is not unique)
+        devices = Device.objects.for_user(self.user).filter(pk=device.pk)
 
-        # For all the battery assignments for this Device, the total of assigned batteries must be <= device capacity
+        # To be safe against concurrent submissions, the form must be validated and saved in a transaction
+        # (see views/assignment.py): the row of the Device is locked until the assignment is saved, so that
+        # a concurrent request for the same Device waits and then reads the updated assigned_qty.
+        # SQLite has no row lock: the whole database is locked by the first write of a transaction,
+        # so a concurrent transaction fails instead of over-assigning (or waits for the lock with the
+        # concurrent mode of config/sqlite_backend, which locks the database when the transaction starts).
+        if connection.features.has_select_for_update and connection.in_atomic_block:
+            devices = devices.select_for_update()
 
-        # The device name/description is not a property of the BatteryAssignment model.
-        # It is a property of the Device model which is referenced in the BatteryAssignment model.
-        # So I need to follow the 'device' key (SQL JOIN)
-        # Since this is a QuerySet based on BatteryAssignment model I need to access the Device model fields
-        # with the syntax: device__description
-        assignments = BatteryAssignment.objects.select_related('device').filter(
-            user=self.user, device__description=self.cleaned_data['device'].description)
-        sum_ = assignments.aggregate(Sum('battery_qty'))  # return a dict like this: {'battery_qty__sum': 26}
-        sum_ = sum_['battery_qty__sum'] if sum_['battery_qty__sum'] else 0
+        # Retrieve the battery capacity of the Device and the total of batteries already assigned to this Device
+        # (maintained in Device.assigned_qty) in a single query
+        battery_capacity, sum_ = devices.values_list('battery_qty', 'assigned_qty').get()
 
-        # The sum_ contains the sum of all current assignments, including the one being updated
-        # self.initial['battery_qty'] contains:
-        # - 0 when a new assignment is created
-        # - the nb of battery for the assignment before it is modified
+        # The assignment being updated (self.instance) is not counted since its battery_qty is replaced
+        # by the one being validated
+        if self.instance._counted and self.instance._counted[0] == device.pk:
+            sum_ -= self.instance._counted[1]
 
-        rest = battery_capacity - sum_ + self.initial['battery_qty']
+        rest = battery_capacity - sum_
 
         # Check the value
         if 1 <= self.cleaned_data['battery_qty'] <= rest:
             pass
         else:
             # raise an error
-            battery_ies = "batteries" if rest > 1 else "battery"
-            raise forms.ValidationError(f"No more than {rest} {battery_ies} can be assigned to this device.",
-                                        code='incorrect_value')
+            raise capacity_error(rest)
 
         # Always return the value being validated
         return self.cleaned_data['battery_qty']
@@ -79,16 +120,18 @@ class BatteryAssignmentFormFilter(forms.Form):
         # - a bound form is created with:    form = AssignmentsViewForm(user=request.user, data=request.GET)
         #
 
+        # The choices of all battery types and models for the current user are cached (see battery/cache.py)
+
         # battery_type
         # Build a choice of all battery types for the current user
-        choices = [(o.id, str(o)) for o in BatteryType.objects.filter(user=user)]
-        choices.insert(0, ('0', 'Select a battery type'))   # Add an instruction at the head of the list of choices
+        # Add an instruction at the head of the list of choices
+        choices = [('0', 'Select a battery type')] + get_choices(BatteryType, user)
         self.fields['battery_type'] = forms.ChoiceField(label="", choices=choices, required=False)
 
         # battery_model
         # Build a choice of all battery models for the current user
-        choices = [(o.id, str(o)) for o in BatteryModel.objects.filter(user=user)]
-        choices.insert(0, ('0', 'Select a battery model'))  # Add an instruction at the head of the list of choices
+        # Add an instruction at the head of the list of choices
+        choices = [('0', 'Select a battery model')] + get_choices(BatteryModel, user)
         self.fields['battery_model'] = forms.ChoiceField(label="", choices=choices, required=False)
 
 
@@ -112,7 +155,8 @@ class DeviceForm(ModelForm):
     def __init__(self, user, *args, **kwargs):
         super(DeviceForm, self).__init__(*args, **kwargs)
         # For the foreign keys: Only show the battery types associated for this user
-        self.fields['battery_type'].queryset = models.BatteryType.objects.filter(user=user)
+        self.fields['battery_type'].queryset = models.BatteryType.objects.for_user(user)
+        set_cached_choices(self.fields['battery_type'], BatteryType, user)
 
 
 class DeviceFormFilter(forms.Form):
@@ -130,7 +174,7 @@ class DeviceFormFilter(forms.Form):
         #
 
         # battery_type
-        # Build a choice of all battery types for the current user
-        choices = [(o.id, str(o)) for o in BatteryType.objects.filter(user=user)]
-        choices.insert(0, ('0', 'Select a battery type'))  # Add an instruction at the head of the list of choices
+        # Build a choice of all battery types for the current user (cached, see battery/cache.py)
+        # Add an instruction at the head of the list of choices
+        choices = [('0', 'Select a battery type')] + get_choices(BatteryType, user)
         self.fields['battery_type'] = forms.ChoiceField(label="", choices=choices, required=False)
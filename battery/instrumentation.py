@@ -0,0 +1,128 @@
+import contextvars
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+#
+# Lightweight instrumentation of the requests, usable in production (unlike the debug toolbar)
+#
+# For a sample of the requests (settings.BATTERY_INSTRUMENTATION['SAMPLE_RATE']), InstrumentationMiddleware records:
+# - the nb of SQL queries and the time spent in the DB (with connection.execute_wrapper())
+# - the time spent rendering the templates (with the template backend InstrumentedDjangoTemplates)
+# - the total time of the request
+# and reports them in a 'Server-Timing' header (shown by the network tab of the browsers) and in a log line
+# (logger 'battery.instrumentation'), logged as a warning when the nb of queries is above QUERY_THRESHOLD.
+# The requests which are not sampled are not instrumented at all.
+#
+# The content of streaming responses (exports) is generated after the middleware: it is not measured.
+#
+
+logger = logging.getLogger('battery.instrumentation')
+
+# Metrics of the request being instrumented, None if the current request is not sampled
+_metrics = contextvars.ContextVar('battery_metrics', default=None)
+
+
+class Metrics:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0     # templates rendered by a template (e.g., crispy forms) are timed by the outer one
+
+    def __call__(self, execute, sql, params, many, context):
+        # Wrapper installed with connection.execute_wrapper()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = settings.BATTERY_INSTRUMENTATION
+        self.sample_rate = config.get('SAMPLE_RATE', 0)
+        self.query_threshold = config.get('QUERY_THRESHOLD')
+        self.server_timing = config.get('SERVER_TIMING', True)
+
+    def __call__(self, request):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        metrics = Metrics()
+        token = _metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        total_time = time.perf_counter() - start
+
+        if self.server_timing:
+            # The templates are often rendered by the view: the template time is included in the view time
+            response['Server-Timing'] = (
+                f'db;dur={1000 * metrics.db_time:.1f};desc="{metrics.queries} queries", '
+                f'tpl;dur={1000 * metrics.template_time:.1f};desc="templates", '
+                f'total;dur={1000 * total_time:.1f}')
+        self.log(request, response, metrics, total_time)
+        return response
+
+    def log(self, request, response, metrics, total_time):
+        resolver_match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': resolver_match.view_name if resolver_match else None,
+            'status': response.status_code,
+            'queries': metrics.queries,
+            'db_ms': round(1000 * metrics.db_time, 2),
+            'template_ms': round(1000 * metrics.template_time, 2),
+            'total_ms': round(1000 * total_time, 2),
+        }
+        if self.query_threshold is not None and metrics.queries > self.query_threshold:
+            record['too_many_queries'] = True
+            logger.warning(json.dumps(record), extra={'metrics': record})
+        else:
+            logger.info(json.dumps(record), extra={'metrics': record})
+
+
+class InstrumentedTemplate(Template):
+    # Template of the Django template backend which adds its rendering time to the metrics of the request
+
+    def render(self, context=None, request=None):
+        metrics = _metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    # Django template backend whose templates are timed by InstrumentationMiddleware
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name).template, self)
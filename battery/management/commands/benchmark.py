@@ -0,0 +1,237 @@
+import json
+import math
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+import requests
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from accounts.models import CustomUser
+from battery.models import BatteryType, BatteryModel, Device, BatteryAssignment
+from battery.queries import QueryRecorder
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of a list of values
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Measure the latency and the SQL queries of the battery views through the Django test client, "
+            "with the inventory of a user created by seed_benchmark. "
+            "With --base-url, the requests are sent over HTTP to a running server (runserver, gunicorn) instead. "
+            "The results can be saved as a JSON baseline and compared with a previous baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="email of the user whose inventory is used "
+                                           "(default: the first user created by seed_benchmark)")
+        parser.add_argument('--repeat', type=int, default=50, help="nb of measured requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=5, help="nb of requests per endpoint before measuring")
+        parser.add_argument('--save', metavar='FILE', help="save the results as a JSON baseline")
+        parser.add_argument('--compare', metavar='FILE', help="compare the results with a JSON baseline")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="fail the comparison when a p95 latency is slower than the baseline by more than "
+                                 "this fraction, or when an endpoint runs more queries (default: 0.2)")
+        parser.add_argument('--base-url', help="send the requests over HTTP to the server running at this URL, "
+                                               "e.g. http://127.0.0.1:8000 (the server must use the same DB). "
+                                               "The POST requests are skipped since they cannot be rolled back")
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="nb of requests sent at the same time, with --base-url (default: 1)")
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        if options['base_url']:
+            results = self.http_results(user, options)
+        else:
+            results = self.client_results(user, options)
+
+        if options['save']:
+            with open(options['save'], 'w') as file:
+                json.dump({'vendor': connection.vendor, 'repeat': options['repeat'], 'base_url': options['base_url'],
+                           'concurrency': options['concurrency'], 'results': results}, file, indent=2)
+            self.stdout.write(f"Baseline saved in {options['save']}")
+        if options['compare']:
+            self.compare(results, options)
+
+    def client_results(self, user, options):
+        # Send the requests through the Django test client, in this process
+        # Same environment as the tests: 'testserver' is an allowed host and DEBUG is off
+        # (the debug toolbar would otherwise be rendered in every page)
+        try:
+            setup_test_environment(debug=False)
+            test_environment = True
+        except RuntimeError:
+            test_environment = False    # already set up, e.g. when run by the tests
+        try:
+            client = Client()
+            client.force_login(user)
+            results = {}
+            for name, request in self.endpoints(user):
+                results[name] = self.measure(client, request, options)
+                self.print_result(name, results[name])
+        finally:
+            if test_environment:
+                teardown_test_environment()
+        return results
+
+    def http_results(self, user, options):
+        # Send the requests over HTTP, with 'concurrency' threads
+        # The nb of queries and the SQL time are read from the 'Server-Timing' header, when the server instruments
+        # the requests (settings.BATTERY_INSTRUMENTATION['SAMPLE_RATE'] = 1)
+        base_url = options['base_url'].rstrip('/')
+        session_key = self.create_session(user)
+        local = threading.local()
+
+        def send(url, data):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.cookies.set(settings.SESSION_COOKIE_NAME, session_key)
+            start = time.perf_counter()
+            response = local.session.get(base_url + url, params=data, allow_redirects=False)
+            return time.perf_counter() - start, response
+
+        results = {}
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            for name, (method, url, data) in self.endpoints(user):
+                if method != 'get':
+                    continue
+                for _ in range(options['warmup']):
+                    send(url, data)
+                start = time.perf_counter()
+                runs = list(pool.map(lambda i: send(url, data), range(options['repeat'])))
+                elapsed = time.perf_counter() - start
+
+                timing = re.search(r'db;dur=([\d.]+);desc="(\d+) queries"', runs[-1][1].headers.get('Server-Timing', ''))
+                results[name] = {
+                    'status': runs[-1][1].status_code,
+                    **self.latencies([latency for latency, response in runs]),
+                    'queries': int(timing.group(2)) if timing else None,
+                    'sql_ms': float(timing.group(1)) if timing else None,
+                    'requests_per_s': round(len(runs) / elapsed, 1),
+                }
+                self.print_result(name, results[name])
+        return results
+
+    def create_session(self, user):
+        # Create a session of the user in the session store shared with the server. Return the session key
+        store = import_module(settings.SESSION_ENGINE).SessionStore()
+        store[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        store[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        store.save()
+        return store.session_key
+
+    def get_user(self, email):
+        users = CustomUser.objects.order_by('pk')
+        user = users.filter(email=email).first() if email else users.filter(email__endswith='@example.invalid').first()
+        if user is None:
+            raise CommandError("No user to benchmark: run seed_benchmark first or use --user")
+        return user
+
+    def endpoints(self, user):
+        # Return the list of (name, request) to measure
+        # A request is a tuple (method, url, data). The POST requests are rolled back after each run
+        battery_type = BatteryType.objects.filter(user=user).first()
+        battery_model = BatteryModel.objects.filter(user=user).first()
+        device = Device.objects.filter(user=user, assigned_qty__lt=F('battery_qty')).first()
+        assignment = BatteryAssignment.objects.filter(user=user).first()
+        if None in (battery_type, battery_model, device, assignment):
+            raise CommandError(f"The inventory of {user.email} is too small to be benchmarked")
+
+        assignment_url = reverse('battery:assignment')
+        device_url = reverse('battery:device')
+        return [
+            ('assignment index', ('get', assignment_url, {})),
+            ('assignment index, filter on type',
+             ('get', assignment_url, {'battery_type': battery_type.pk, 'battery_model': 0})),
+            ('assignment index, filter on model',
+             ('get', assignment_url, {'battery_type': 0, 'battery_model': battery_model.pk})),
+            ('assignment index, filter on type and model',
+             ('get', assignment_url, {'battery_type': battery_type.pk, 'battery_model': battery_model.pk})),
+            ('device index', ('get', device_url, {})),
+            ('device index, filter on type', ('get', device_url, {'battery_type': battery_type.pk})),
+            ('assignment create form', ('get', reverse('battery:assignment_create'), {})),
+            ('assignment create (POST)',
+             ('post', reverse('battery:assignment_create'),
+              {'device': device.pk, 'battery_model': battery_model.pk, 'battery_qty': 1})),
+            ('assignment update (POST)',
+             ('post', reverse('battery:assignment_detail', args=[assignment.pk]),
+              {'device': assignment.device_id, 'battery_model': assignment.battery_model_id,
+               'battery_qty': assignment.battery_qty})),
+        ]
+
+    def measure(self, client, request, options):
+        method, url, data = request
+        latencies, sql_times, queries, status = [], [], 0, None
+        for run in range(options['warmup'] + options['repeat']):
+            recorder = QueryRecorder()
+            with transaction.atomic():
+                start = time.perf_counter()
+                with connection.execute_wrapper(recorder):
+                    response = getattr(client, method)(url, data)
+                latency = time.perf_counter() - start
+                if method != 'get':
+                    transaction.set_rollback(True)  # keep the same inventory for every run
+            if run >= options['warmup']:
+                latencies.append(latency)
+                sql_times.append(recorder.duration)
+                queries = len(recorder.queries)
+                status = response.status_code
+        return {
+            'status': status,
+            **self.latencies(latencies),
+            'queries': queries,
+            'sql_ms': round(1000 * statistics.median(sql_times), 3),
+        }
+
+    def latencies(self, latencies):
+        return {'p50_ms': round(1000 * percentile(latencies, 50), 3),
+                'p95_ms': round(1000 * percentile(latencies, 95), 3)}
+
+    def print_result(self, name, result):
+        line = f"{name:45} {result['status']}  p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms"
+        if result['queries'] is not None:
+            line += f"  {result['queries']:3} queries  SQL {result['sql_ms']:7.2f}ms"
+        if 'requests_per_s' in result:
+            line += f"  {result['requests_per_s']:7.1f} req/s"
+        self.stdout.write(line)
+
+    def compare(self, results, options):
+        with open(options['compare']) as file:
+            baseline = json.load(file)['results']
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nComparison with {options['compare']}"))
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                self.stdout.write(f"{name:45} not in the baseline")
+                continue
+            base = baseline[name]
+            p95_change = result['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] else 0
+            more_queries = None not in (result['queries'], base['queries']) and result['queries'] > base['queries']
+            line = f"{name:45} p50 {result['p50_ms'] - base['p50_ms']:+8.2f}ms  p95 {p95_change:+7.1%}"
+            if None not in (result['queries'], base['queries']):
+                line += f"  queries {result['queries'] - base['queries']:+d}"
+            if 'requests_per_s' in result and base.get('requests_per_s'):
+                line += f"  req/s {result['requests_per_s'] / base['requests_per_s'] - 1:+7.1%}"
+            if p95_change > options['tolerance'] or more_queries:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} endpoints regressed: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS("No regression"))
@@ -0,0 +1,119 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.urls import reverse
+
+from accounts.models import CustomUser
+from battery import views
+from battery.forms import BatteryAssignmentForm
+from battery.models import BatteryType, BatteryModel, Device, BatteryAssignment
+from battery.queries import QueryRecorder
+from battery.synthetic import generate_inventory
+
+
+class Command(BaseCommand):
+    help = ("Print the EXPLAIN plan and the timings of the SQL queries run by the battery views, "
+            "on a synthetic dataset which is rolled back at the end")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="nb of users sharing the tables (default: 10)")
+        parser.add_argument('--devices', type=int, default=2000, help="nb of devices per user (default: 2000)")
+        parser.add_argument('--assignments', type=int, default=5000,
+                            help="nb of battery assignments per user (default: 5000)")
+        parser.add_argument('--repeat', type=int, default=20, help="nb of runs of each view for the timings")
+        parser.add_argument('--no-plan', action='store_true', help="only print the timings")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.generate(options)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')   # collect statistics on the new rows for the query planner
+
+            for name, run in self.cases(user):
+                self.run_case(name, run, options)
+
+            transaction.set_rollback(True)  # drop the synthetic dataset
+
+    def generate(self, options):
+        # Create the synthetic users and their inventory. Return the user whose queries are measured
+        start = time.perf_counter()
+        for i in range(options['users']):
+            user = CustomUser.objects.create_user(username=f'explain{i}', email=f'explain{i}@example.invalid')
+            generate_inventory(user, devices=options['devices'], assignments=options['assignments'], seed=i)
+        self.stdout.write(f"Generated {options['users']} users with {options['devices']} devices and "
+                          f"{options['assignments']} assignments each in {time.perf_counter() - start:.1f}s\n")
+        return user
+
+    def cases(self, user):
+        # Return the list of (name, callable) to measure. Each callable runs the code path of a view
+        factory = RequestFactory()
+        battery_type = BatteryType.objects.filter(user=user).first()
+        battery_model = BatteryModel.objects.filter(user=user).first()
+        device = Device.objects.filter(user=user).last()
+        last = BatteryAssignment.objects.filter(user=user).order_by('pk').last()
+
+        def view(func, url, **params):
+            def run():
+                request = factory.get(url, params)
+                request.user = user
+                func(request)
+            return run
+
+        def assignment_form():
+            form = BatteryAssignmentForm(user=user, data={'device': device.pk, 'battery_model': battery_model.pk,
+                                                          'battery_qty': 1})
+            form.is_valid()
+
+        url = reverse('battery:assignment')
+        return [
+            ('assignment index', view(views.assignment, url)),
+            ('assignment index, filter on type',
+             view(views.assignment, url, battery_type=battery_type.pk, battery_model=0)),
+            ('assignment index, filter on model',
+             view(views.assignment, url, battery_type=0, battery_model=battery_model.pk)),
+            ('assignment index, filter on type and model',
+             view(views.assignment, url, battery_type=battery_type.pk, battery_model=battery_model.pk)),
+            ('assignment index, last page', view(views.assignment, url, before=last.pk)),
+            ('device index', view(views.device, reverse('battery:device'))),
+            ('device index, filter on type',
+             view(views.device, reverse('battery:device'), battery_type=battery_type.pk)),
+            ('model index', view(views.model, reverse('battery:model'))),
+            ('type index', view(views.type_index, reverse('battery:type'))),
+            ('assignment form validation', assignment_form),
+        ]
+
+    def run_case(self, name, run, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{name}"))
+
+        # Run once to record the queries, then print their plan
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            run()
+        if not options['no_plan']:
+            for sql, params, duration in recorder.queries:
+                self.stdout.write(f"  {sql}")
+                for line in self.explain(sql, params):
+                    self.stdout.write(f"    {line}")
+
+        # Timings
+        timings, sql_timings = [], []
+        for _ in range(options['repeat']):
+            recorder = QueryRecorder()
+            start = time.perf_counter()
+            with connection.execute_wrapper(recorder):
+                run()
+            timings.append(time.perf_counter() - start)
+            sql_timings.append(recorder.duration)
+        self.stdout.write(self.style.SUCCESS(
+            f"  {len(recorder.queries)} queries, view: avg {1000 * sum(timings) / len(timings):.2f}ms "
+            f"min {1000 * min(timings):.2f}ms, SQL: avg {1000 * sum(sql_timings) / len(sql_timings):.2f}ms"))
+
+    def explain(self, sql, params):
+        # Return the lines of the plan of a query, in the format of the DB backend
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            rows = cursor.fetchall()
+        # The description of each step of the plan is in the last column (SQLite also returns node ids)
+        return [str(row[-1]) for row in rows]
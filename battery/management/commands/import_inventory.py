@@ -0,0 +1,189 @@
+import contextlib
+import csv
+import io
+import itertools
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import CustomUser
+from battery import search
+from battery.cache import invalidate_choices, invalidate_inventory
+from battery.forms import capacity_error
+from battery.models import BatteryType, BatteryModel, Device, BatteryAssignment
+from battery.queries import refresh_assigned_qty
+
+
+class Command(BaseCommand):
+    help = """Import the inventory of a user from a CSV file.
+
+The CSV file has a header line with the columns:
+  device        description of the device (required)
+  battery_type  type of battery of the device, e.g. AA (required for a new device)
+  capacity      nb of batteries of the device, 1 to 10 (required for a new device)
+  battery_model description of the battery model assigned to the device (optional)
+  battery_qty   nb of batteries of this model assigned to the device (required with battery_model)
+
+Devices, battery types and battery models are identified by their description/type: the ones which do not
+exist yet are created. A row with a battery_model creates a battery assignment, within the capacity of the
+device. The rows which are not valid are reported and skipped.
+"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="CSV file to import, '-' for the standard input")
+        parser.add_argument('--user', required=True, help="email of the user who owns the inventory")
+        parser.add_argument('--encoding', default='utf-8-sig',
+                            help="encoding of the file (default: UTF-8, with or without a byte order mark)")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="nb of rows written in each transaction (default: 1000)")
+        parser.add_argument('--dry-run', action='store_true', help="validate the file but do not write to the DB")
+
+    def handle(self, *args, **options):
+        try:
+            self.user = CustomUser.objects.get(email=options['user'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No user with email {options['user']}")
+
+        self.load_maps()
+        self.errors = 0
+        imported = 0
+        start = time.perf_counter()
+
+        try:
+            if options['file'] == '-':
+                file = io.TextIOWrapper(sys.stdin.buffer, encoding=options['encoding'], newline='')
+            else:
+                file = open(options['file'], encoding=options['encoding'], newline='')
+        except (OSError, LookupError) as e:    # LookupError: unknown encoding
+            raise CommandError(f"Cannot read {options['file']}: {e}")
+        # Dry run: everything is done in one transaction which is rolled back at the end
+        with file, transaction.atomic() if options['dry_run'] else contextlib.nullcontext():
+            rows = enumerate(csv.DictReader(file), start=2)    # line 1 is the header
+            for batch_nb in itertools.count(1):
+                try:
+                    batch = list(itertools.islice(rows, options['batch_size']))
+                except UnicodeDecodeError as e:
+                    # The batches already imported stay in the DB (unless --dry-run)
+                    raise CommandError(f"Cannot read {options['file']} as {options['encoding']} after {imported} "
+                                       f"rows imported: {e} (see --encoding)")
+                if not batch:
+                    break
+                batch_start = time.perf_counter()
+                with transaction.atomic():
+                    done = self.import_batch(batch)
+                duration = time.perf_counter() - batch_start
+                imported += done
+                self.stdout.write(f"Batch {batch_nb}: {done}/{len(batch)} rows imported in {duration:.2f}s "
+                                  f"({len(batch) / duration:.0f} rows/s)")
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        # bulk_create() does not send the signals which evict the cached choices of the forms
+        for model in (BatteryType, BatteryModel, Device):
+            invalidate_choices(model, self.user.pk)
+        invalidate_inventory(self.user.pk)
+
+        duration = time.perf_counter() - start
+        summary = f"{imported} rows imported, {self.errors} rows with errors, in {duration:.2f}s"
+        if options['dry_run']:
+            summary += " (dry run: nothing was written)"
+        self.stdout.write(self.style.SUCCESS(summary) if not self.errors else self.style.WARNING(summary))
+
+    def load_maps(self):
+        # Load the natural keys of the user's inventory once: no query per row
+        self.types = dict(BatteryType.objects.filter(user=self.user).values_list('type', 'pk'))
+        self.models = dict(BatteryModel.objects.filter(user=self.user).values_list('description', 'pk'))
+        # description -> [pk, battery capacity, nb of batteries assigned]
+        self.devices = {description: [pk, battery_qty, assigned_qty]
+                        for pk, description, battery_qty, assigned_qty in Device.objects.filter(
+                            user=self.user).order_by('-pk').values_list('pk', 'description', 'battery_qty',
+                                                                        'assigned_qty')}
+
+    def error(self, line, message):
+        self.errors += 1
+        self.stderr.write(f"Line {line}: {message}")
+
+    def parse(self, line, row):
+        # Validate a row of the file. Return a dict of the cleaned values, None if the row is not valid
+        values = {name: (row.get(name) or '').strip() for name in
+                  ('device', 'battery_type', 'capacity', 'battery_model', 'battery_qty')}
+        for name, model, field in (('device', Device, 'description'), ('battery_type', BatteryType, 'type'),
+                                   ('battery_model', BatteryModel, 'description')):
+            if len(values[name]) > model._meta.get_field(field).max_length:
+                return self.error(line, f"{name} is too long")
+        if not values['device']:
+            return self.error(line, "device is required")
+
+        if values['device'] not in self.devices and values['device'] not in self.new_devices:
+            if not values['battery_type']:
+                return self.error(line, "battery_type is required for a new device")
+            # isdecimal(), not isdigit(): int() rejects digits such as '²'
+            if not values['capacity'].isdecimal() or not 1 <= int(values['capacity']) <= 10:
+                return self.error(line, "capacity must be a number from 1 to 10 for a new device")
+
+        if bool(values['battery_model']) != bool(values['battery_qty']):
+            return self.error(line, "battery_model and battery_qty must be given together")
+        if values['battery_qty'] and not values['battery_qty'].isdecimal():
+            return self.error(line, "battery_qty must be a number")
+        return values
+
+    def import_batch(self, batch):
+        # Import the rows of a batch. Return the nb of rows imported
+        self.new_devices = {}
+        rows = []
+        for line, row in batch:
+            values = self.parse(line, row)
+            if values:
+                rows.append((line, values))
+                if values['device'] not in self.devices:
+                    self.new_devices.setdefault(values['device'], values)
+
+        # Create the battery types, models and devices which do not exist yet
+        self.create(BatteryType, 'type', self.types,
+                    {values['battery_type'] for values in self.new_devices.values()})
+        self.create(BatteryModel, 'description', self.models,
+                    {values['battery_model'] for line, values in rows if values['battery_model']})
+        if self.new_devices:
+            Device.objects.bulk_create([
+                Device(description=description, battery_type_id=self.types[values['battery_type']],
+                       battery_qty=int(values['capacity']), user=self.user)
+                for description, values in self.new_devices.items()])
+            # SQLite does not return the primary keys of the rows inserted by bulk_create(): read them back
+            for pk, description, battery_qty in Device.objects.filter(
+                    user=self.user, description__in=self.new_devices).order_by('pk').values_list(
+                    'pk', 'description', 'battery_qty'):
+                self.devices[description] = [pk, battery_qty, 0]
+
+        # Battery assignments, validated against the capacity of the devices
+        imported = len(rows)
+        assignments = []
+        for line, values in rows:
+            if not values['battery_model']:
+                continue
+            device = self.devices[values['device']]
+            qty = int(values['battery_qty'])
+            rest = device[1] - device[2]
+            if not 1 <= qty <= rest:
+                self.error(line, f"{values['device']}: {capacity_error(rest).messages[0]}")
+                imported -= 1
+                continue
+            device[2] += qty
+            assignments.append(BatteryAssignment(device_id=device[0], battery_model_id=self.models[
+                values['battery_model']], battery_qty=qty, user=self.user))
+        BatteryAssignment.objects.bulk_create(assignments)
+
+        # bulk_create() does not send the signals which maintain Device.assigned_qty
+        refresh_assigned_qty(Device.objects.filter(pk__in={assignment.device_id for assignment in assignments}))
+        # ... nor the signals which index the new rows for the search
+        search.index_new([self.user.pk])
+
+        return imported
+
+    def create(self, model, field, keys, wanted):
+        # Create the instances of 'model' whose natural key ('field') is in 'wanted' but not in the map 'keys'
+        missing = wanted - set(keys)
+        if missing:
+            model.objects.bulk_create([model(**{field: key}, user=self.user) for key in missing])
+            keys.update(model.objects.filter(user=self.user, **{f'{field}__in': missing}).values_list(field, 'pk'))
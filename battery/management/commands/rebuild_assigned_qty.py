@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from battery.cache import invalidate_inventory
+from battery.models import Device
+from battery.queries import refresh_assigned_qty, wrong_assigned_qty
+
+
+class Command(BaseCommand):
+    help = ("Verify and rebuild the nb of batteries assigned to each device (Device.assigned_qty) "
+            "from the battery assignments")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="only report the devices with a wrong counter, exit with an error if any")
+
+    def handle(self, *args, **options):
+        wrong = list(wrong_assigned_qty().values_list('pk', 'description', 'assigned_qty', 'actual_qty'))
+        for pk, description, assigned_qty, actual_qty in wrong:
+            self.stdout.write(f"Device {pk} '{description}': assigned_qty is {assigned_qty}, should be {actual_qty}")
+
+        if options['check']:
+            if wrong:
+                raise CommandError(f"{len(wrong)} device(s) with a wrong assigned_qty")
+            self.stdout.write(self.style.SUCCESS("All the devices have a correct assigned_qty"))
+        else:
+            count = refresh_assigned_qty()
+            # The overview of the inventory of the users whose counters were wrong is outdated
+            wrong_ids = [pk for pk, description, assigned_qty, actual_qty in wrong]
+            for user_id in Device.objects.filter(pk__in=wrong_ids).values_list('user_id', flat=True).distinct():
+                invalidate_inventory(user_id)
+            self.stdout.write(self.style.SUCCESS(f"assigned_qty rebuilt for {count} device(s), "
+                                                 f"{len(wrong)} were wrong"))
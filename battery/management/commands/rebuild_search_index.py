@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import CustomUser
+from battery.search import rebuild, optimize
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the full-text search entries of the battery types, battery models, devices and assignments "
+            "(after the migration which creates them, or after a loaddata)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="email of the user whose entries are rebuilt (default: all the users)")
+        parser.add_argument('--batch-size', type=int, default=100, help="nb of users rebuilt in each transaction")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.order_by('pk')
+        if options['user']:
+            users = users.filter(email=options['user'])
+
+        start = time.perf_counter()
+        total = 0
+        user_ids = list(users.values_list('pk', flat=True))
+        for batch_start in range(0, len(user_ids), options['batch_size']):
+            with transaction.atomic():
+                total += rebuild(user_ids[batch_start:batch_start + options['batch_size']])
+        optimize()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} search entries of {len(user_ids)} users rebuilt in {time.perf_counter() - start:.2f}s"))
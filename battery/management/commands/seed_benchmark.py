@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import CustomUser
+from battery.synthetic import generate_inventory
+
+
+class Command(BaseCommand):
+    help = ("Create users with a synthetic inventory, to measure the battery views with the benchmark command. "
+            "The users are named <prefix><i>@example.invalid and cannot log in with a password")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="nb of users (default: 10)")
+        parser.add_argument('--types', type=int, default=5, help="nb of battery types per user (default: 5)")
+        parser.add_argument('--models', type=int, default=5, help="nb of battery models per user (default: 5)")
+        parser.add_argument('--devices', type=int, default=1000, help="nb of devices per user (default: 1000)")
+        parser.add_argument('--assignments', type=int, default=2000,
+                            help="nb of battery assignments per user (default: 2000)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="nb of rows per INSERT (default: 1000)")
+        parser.add_argument('--prefix', default='bench', help="prefix of the usernames and emails (default: bench)")
+        parser.add_argument('--clear', action='store_true',
+                            help="delete the existing users with this prefix and their inventory first")
+
+    def handle(self, *args, **options):
+        for name in ('users', 'types', 'models', 'devices', 'assignments'):
+            if options[name] < 0:
+                raise CommandError(f"--{name} must not be negative")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        # Each device has a battery type, each assignment a battery model
+        if options['devices'] and not options['types']:
+            raise CommandError("--types must be at least 1 to create devices")
+        if options['assignments'] and not options['models']:
+            raise CommandError("--models must be at least 1 to create battery assignments")
+
+        prefix = options['prefix']
+        if options['clear']:
+            deleted, per_model = CustomUser.objects.filter(email__startswith=prefix,
+                                                           email__endswith='@example.invalid').delete()
+            self.stdout.write(f"Deleted {per_model.get(CustomUser._meta.label, 0)} users ({deleted} rows)")
+
+        start = time.perf_counter()
+        for i in range(options['users']):
+            # One transaction per user: an interrupted run leaves complete users only
+            with transaction.atomic():
+                user = CustomUser.objects.create_user(username=f'{prefix}{i}', email=f'{prefix}{i}@example.invalid')
+                counts = generate_inventory(user, types=options['types'], models=options['models'],
+                                            devices=options['devices'], assignments=options['assignments'],
+                                            batch_size=options['batch_size'], seed=i)
+            self.stdout.write(f"{user.email}: " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {options['users']} users in {time.perf_counter() - start:.1f}s"))
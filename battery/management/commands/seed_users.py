@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import CustomUser
+from battery.seed import seed_users
+
+
+class Command(BaseCommand):
+    help = ("Create the battery types and battery models of settings.BATTERY_SEED_DATA "
+            "for the existing users who do not have them")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="email of the user to seed (default: all the users)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="nb of users seeded in each transaction")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.order_by('pk')
+        if options['user']:
+            users = users.filter(email=options['user'])
+
+        total = {}
+        user_ids = list(users.values_list('pk', flat=True))
+        for start in range(0, len(user_ids), options['batch_size']):
+            batch = users.filter(pk__in=user_ids[start:start + options['batch_size']])
+            with transaction.atomic():
+                for name, count in seed_users(batch).items():
+                    total[name] = total.get(name, 0) + count
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(user_ids)} users checked, created: " +
+            ", ".join(f"{count} {name}s" for name, count in total.items())))
@@ -0,0 +1,128 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from accounts.models import CustomUser
+from battery.forms import BatteryAssignmentForm
+from battery.models import BatteryType, BatteryModel, Device
+
+# The SQLite modes which are compared, with the value of DJANGO_SQLITE_CONCURRENT (see config/settings.py)
+MODES = {
+    'stock': '0',           # django.db.backends.sqlite3: rollback journal, deferred transactions
+    'concurrent': '1',      # config.sqlite_backend: WAL, busy timeout, BEGIN IMMEDIATE
+}
+
+EMAIL = 'sqlite-write-benchmark@example.invalid'
+
+
+class Command(BaseCommand):
+    help = ("Measure the write throughput of SQLite with several processes saving battery assignments at the same "
+            "time, as gunicorn workers do, with the stock SQLite backend and with the concurrent mode "
+            "(DJANGO_SQLITE_CONCURRENT=1). Each mode runs on a new temporary database: the project DB is not used")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8, help="nb of writing processes (default: 8)")
+        parser.add_argument('--writes', type=int, default=50, help="nb of assignments saved by each process")
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES),
+                            help="SQLite modes to measure (default: all)")
+        parser.add_argument('--start-delay', type=float, default=5,
+                            help="seconds given to the processes to start before they all write at the same time")
+        # Internal, used by the processes started by the command
+        parser.add_argument('--setup', action='store_true', help="(internal) create the inventory")
+        parser.add_argument('--worker', type=int, help="(internal) run as the writing process with this index")
+        parser.add_argument('--start-at', type=float, help="(internal) time when the worker starts writing")
+
+    def handle(self, *args, **options):
+        if options['setup']:
+            self.setup(options)
+        elif options['worker'] is not None:
+            self.worker(options)
+        else:
+            if connection.vendor != 'sqlite':
+                raise CommandError("This benchmark is for SQLite only")
+            results = {mode: self.run(mode, options) for mode in options['modes']}
+            if len(results) > 1:
+                base, *others = results.items()
+                for mode, result in others:
+                    gain = result['writes_per_s'] / base[1]['writes_per_s'] - 1 if base[1]['writes_per_s'] else 0
+                    self.stdout.write(f"{mode} vs {base[0]}: {gain:+.1%} writes/s, "
+                                      f"{result['locked'] - base[1]['locked']:+d} 'database is locked' errors")
+
+    def run(self, mode, options):
+        # Measure a mode: create a new database, then start the processes which write at the same time
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, 'DJANGO_SQLITE_NAME': os.path.join(directory, 'db.sqlite3'),
+                   'DJANGO_SQLITE_CONCURRENT': MODES[mode]}
+            env.pop('POSTGRES_HOST', None)
+            manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{mode}: creating the database"))
+            subprocess.run(manage + ['migrate', '--no-input', '-v', '0'], env=env, check=True)
+            subprocess.run(manage + ['sqlite_write_benchmark', '--setup', '--processes', str(options['processes']),
+                                     '--writes', str(options['writes'])], env=env, check=True)
+
+            start_at = time.time() + options['start_delay']
+            workers = [subprocess.Popen(manage + ['sqlite_write_benchmark', '--worker', str(i),
+                                                  '--processes', str(options['processes']),
+                                                  '--writes', str(options['writes']), '--start-at', str(start_at)],
+                                        env=env, stdout=subprocess.PIPE, text=True)
+                       for i in range(options['processes'])]
+            reports = [json.loads(worker.communicate()[0]) for worker in workers]
+
+        if any(report['late'] for report in reports):
+            self.stdout.write(self.style.WARNING("Some processes started after the others: increase --start-delay"))
+        elapsed = max(report['end'] for report in reports) - start_at
+        result = {
+            'saved': sum(report['saved'] for report in reports),
+            'locked': sum(report['locked'] for report in reports),
+            'seconds': round(elapsed, 3),
+        }
+        result['writes_per_s'] = round(result['saved'] / elapsed, 1)
+        self.stdout.write(f"{mode:12} {result['saved']:6} saved  {result['locked']:6} 'database is locked'  "
+                          f"{result['seconds']:8.3f}s  {result['writes_per_s']:8.1f} writes/s")
+        return result
+
+    def setup(self, options):
+        # Create a user with enough free devices for all the assignments: each device holds 10 batteries
+        user = CustomUser.objects.create_user(username=EMAIL, email=EMAIL, password=None)
+        battery_type = BatteryType.objects.create(type='AA', user=user)
+        BatteryModel.objects.create(description='benchmark', user=user)
+        nb_devices = -(-options['processes'] * options['writes'] // 10)
+        Device.objects.bulk_create(
+            Device(description=f"device {i}", battery_type=battery_type, battery_qty=10, user=user)
+            for i in range(nb_devices))
+
+    def worker(self, options):
+        # Save 'writes' assignments as the assignment_detail view does: the capacity of the device is read, then
+        # the assignment is saved, in the same transaction
+        user = CustomUser.objects.get(email=EMAIL)
+        battery_model = BatteryModel.objects.get(user=user)
+        devices = list(Device.objects.filter(user=user).order_by('pk').values_list('pk', flat=True))
+
+        late = time.time() > options['start_at']
+        time.sleep(max(options['start_at'] - time.time(), 0))
+        saved = locked = 0
+        for i in range(options['writes']):
+            # Every write of every process is on a different slot: no device is assigned more than 10 batteries
+            device = devices[(i * options['processes'] + options['worker']) % len(devices)]
+            try:
+                with transaction.atomic():
+                    form = BatteryAssignmentForm(user=user, data={'device': device, 'battery_model': battery_model.pk,
+                                                                  'battery_qty': 1})
+                    if form.is_valid():
+                        instance = form.save(commit=False)
+                        instance.user = user
+                        instance.save()
+                        saved += 1
+            except OperationalError as error:
+                if 'locked' not in str(error):
+                    raise
+                locked += 1
+        self.stdout.write(json.dumps({'saved': saved, 'locked': locked, 'end': time.time(), 'late': late}))
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.5 on 2026-10-18 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battery', '0008_auto_20210124_1322'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='batteryassignment',
+            name='battery_qty',
+            field=models.PositiveSmallIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='batteryassignment',
+            index=models.Index(fields=['user', 'device'], name='battery_asg_user_device_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batteryassignment',
+            index=models.Index(fields=['user', 'battery_model'], name='battery_asg_user_model_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batterymodel',
+            index=models.Index(fields=['user', 'description'], name='battery_model_user_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batterytype',
+            index=models.Index(fields=['user', 'type'], name='battery_type_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['user', 'battery_type'], name='battery_dev_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['user', 'description'], name='battery_dev_user_desc_idx'),
+        ),
+    ]
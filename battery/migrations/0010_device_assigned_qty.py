@@ -0,0 +1,30 @@
+# Generated by Django 3.1.5 on 2026-10-18 15:02
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def compute_assigned_qty(apps, schema_editor):
+    # Initialize the counter of the existing devices from their battery assignments
+    Device = apps.get_model('battery', 'Device')
+    BatteryAssignment = apps.get_model('battery', 'BatteryAssignment')
+    assigned = BatteryAssignment.objects.filter(device=OuterRef('pk')).order_by().values('device')
+    assigned = assigned.annotate(total=Sum('battery_qty')).values('total')
+    Device.objects.update(assigned_qty=Coalesce(Subquery(assigned), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battery', '0009_user_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='assigned_qty',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_assigned_qty, migrations.RunPython.noop),
+    ]
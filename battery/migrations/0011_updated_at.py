@@ -0,0 +1,49 @@
+# Generated by Django 3.1.5 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battery', '0010_device_assigned_qty'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batteryassignment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='batterymodel',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='batterytype',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='batteryassignment',
+            index=models.Index(fields=['user', 'updated_at'], name='battery_asg_user_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batterymodel',
+            index=models.Index(fields=['user', 'updated_at'], name='battery_model_user_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batterytype',
+            index=models.Index(fields=['user', 'updated_at'], name='battery_type_user_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['user', 'updated_at'], name='battery_dev_user_upd_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.1.5 on 2026-10-18 15:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Full-text index of SearchEntry.text, for each DB (see battery/search.py)
+# SQLite: FTS5 table whose content is read from battery_searchentry, kept in sync by triggers. The user is indexed
+# with the text, so that the words are only looked up in the entries of the user. The prefixes of 1 to 3 characters
+# are indexed too: the last word of a search is matched as a prefix
+# PostgreSQL: GIN index on the tsvector of the text
+FULL_TEXT_SQL = {
+    'sqlite': [
+        """CREATE VIRTUAL TABLE battery_searchentry_fts USING fts5(
+               user_id, text, content='battery_searchentry', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')""",
+        """CREATE TRIGGER battery_searchentry_ai AFTER INSERT ON battery_searchentry BEGIN
+               INSERT INTO battery_searchentry_fts(rowid, user_id, text) VALUES (new.id, new.user_id, new.text);
+           END""",
+        """CREATE TRIGGER battery_searchentry_ad AFTER DELETE ON battery_searchentry BEGIN
+               INSERT INTO battery_searchentry_fts(battery_searchentry_fts, rowid, user_id, text)
+                   VALUES ('delete', old.id, old.user_id, old.text);
+           END""",
+        """CREATE TRIGGER battery_searchentry_au AFTER UPDATE ON battery_searchentry BEGIN
+               INSERT INTO battery_searchentry_fts(battery_searchentry_fts, rowid, user_id, text)
+                   VALUES ('delete', old.id, old.user_id, old.text);
+               INSERT INTO battery_searchentry_fts(rowid, user_id, text) VALUES (new.id, new.user_id, new.text);
+           END""",
+    ],
+    'postgresql': [
+        "CREATE INDEX battery_searchentry_text_fts ON battery_searchentry USING GIN (to_tsvector('simple', text))",
+    ],
+}
+
+REVERSE_SQL = {
+    'sqlite': ['DROP TABLE battery_searchentry_fts'],  # the triggers are dropped with battery_searchentry
+    'postgresql': ['DROP INDEX battery_searchentry_text_fts'],
+}
+
+
+def create_full_text_index(apps, schema_editor):
+    for sql in FULL_TEXT_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_full_text_index(apps, schema_editor):
+    for sql in REVERSE_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('battery', '0011_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('type', 'Battery type'), ('model', 'Battery model'), ('device', 'Device'), ('assignment', 'Battery assignment')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchentry',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='battery_search_kind_object_uniq'),
+        ),
+        migrations.RunPython(create_full_text_index, drop_full_text_index),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Index of the prefix search of the typeahead on PostgreSQL (see Resource.search() in battery/api/resources.py):
+# the range is compared with COLLATE "C", which the indexes of the default collation cannot serve
+# The other DBs compare the texts by code points: the (user, description) indexes serve the range
+COLLATE_C_SQL = {
+    'postgresql': [
+        'CREATE INDEX battery_dev_user_desc_c_idx ON battery_device (user_id, description COLLATE "C")',
+        'CREATE INDEX battery_model_user_desc_c_idx ON battery_batterymodel (user_id, description COLLATE "C")',
+    ],
+}
+
+REVERSE_SQL = {
+    'postgresql': [
+        'DROP INDEX battery_dev_user_desc_c_idx',
+        'DROP INDEX battery_model_user_desc_c_idx',
+    ],
+}
+
+
+def create_indexes(apps, schema_editor):
+    for sql in COLLATE_C_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    for sql in REVERSE_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battery', '0012_searchentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
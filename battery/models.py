@@ -1,17 +1,124 @@
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Sum
+from django.dispatch import Signal
 from accounts.models import CustomUser
 
 
 # Create your models here.
 
+# The views and the forms read the rows of a user with Model.objects.for_user(user) (see BatteryQuerySet below)
+# instead of Model.objects.filter(user=user): the joins needed to render the rows come with it, so that a new page
+# does not bring back one query per row
+
+# Sent once by each deletion of rows of the inventory, before the rows are deleted, with the QuerySet of the rows
+# deleted and of the rows deleted in cascade ('deleted': model -> QuerySet, see BatteryQuerySet.cascade())
+# The models have no pre_delete/post_delete receivers: with them, Django would load the rows deleted in cascade and
+# send the signals row by row, i.e., several queries per row. Without them, each table is deleted with a few queries
+# whatever the nb of rows, and the receivers of rows_deleting update the data derived from the rows in bulk
+# (see battery/signals.py)
+rows_deleting = Signal()
+
+
+class BatteryQuerySet(models.QuerySet):
+    related = ()        # foreign keys followed by str() of the rows: joined by for_user()
+    list_fields = ()    # columns rendered by the index pages: the only ones read by for_list() (empty = all)
+    total_field = None  # field summed by totals()
+
+    def for_user(self, user):
+        # The rows of the user, with their foreign keys rendered by str()
+        return self.filter(user=user).select_related(*self.related)
+
+    def for_list(self):
+        # Only read the columns rendered by the index pages
+        return self.only(*self.list_fields) if self.list_fields else self
+
+    def totals(self):
+        # Return the nb of rows and the total of total_field in a single aggregate query
+        # i.e., one scan of the filtered rows instead of one for .count() and one for .aggregate(Sum())
+        # return a dict like this: {'count': 12, 'battery_total': 26}
+        queryset = self.order_by().select_related(None)
+        if self.total_field is None:
+            return {'count': queryset.count()}
+        totals = queryset.aggregate(count=Count('pk'), battery_total=Sum(self.total_field))
+        totals['battery_total'] = totals['battery_total'] or 0   # Sum() is None when there is no row
+        return totals
+
+    def cascade(self):
+        # Return the rows deleted with these rows: a dict model -> QuerySet, including the model of these rows
+        return {self.model: self}
+
+    def delete(self):
+        # Delete the rows, and the rows which reference them, after sending rows_deleting
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows_deleting.send(sender=self.model, deleted=self.cascade())
+            return super().delete()
+
+    delete.alters_data = True
+
+
+class BatteryTypeQuerySet(BatteryQuerySet):
+    list_fields = ('type', 'description')
+
+    def cascade(self):
+        devices = Device.objects.filter(battery_type__in=self.values('pk'))
+        return {**devices.cascade(), BatteryType: self}
+
+
+class DeviceQuerySet(BatteryQuerySet):
+    related = ('battery_type',)
+    list_fields = ('description', 'battery_type__type', 'battery_qty', 'assigned_qty')
+    total_field = 'battery_qty'
+
+    def cascade(self):
+        return {Device: self, BatteryAssignment: BatteryAssignment.objects.filter(device__in=self.values('pk'))}
+
+
+class BatteryModelQuerySet(BatteryQuerySet):
+    list_fields = ('description',)
+
+    def cascade(self):
+        return {BatteryModel: self,
+                BatteryAssignment: BatteryAssignment.objects.filter(battery_model__in=self.values('pk'))}
+
+
+class BatteryAssignmentQuerySet(BatteryQuerySet):
+    related = ('device__battery_type', 'battery_model')
+    list_fields = ('device__description', 'device__battery_qty', 'device__battery_type__type',
+                   'battery_model__description', 'battery_qty')
+    total_field = 'battery_qty'
+
+
+class BatteryRow(models.Model):
+    # Base of the models of the inventory: a row is deleted as a QuerySet, with a single rows_deleting signal
+
+    class Meta:
+        abstract = True
+
+    def delete(self, using=None, keep_parents=False):
+        return type(self).objects.db_manager(using).filter(pk=self.pk).delete()
+
+    delete.alters_data = True
+
+
 # This class will be mapped to a database schema with "./manage.py makemigrations"
 # the DB will be migrated with "./manage.py migrate"
 
-class BatteryType(models.Model):
+class BatteryType(BatteryRow):
     type = models.CharField(max_length=10)
     description = models.CharField(max_length=100, blank=True)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    # Time of the last change, used by the conditional GET of the pages (see battery/conditional.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BatteryTypeQuerySet.as_manager()
+
+    class Meta:
+        # All the queries filter on the user first (see battery/views and battery/forms.py)
+        indexes = [
+            models.Index(fields=['user', 'type'], name='battery_type_user_type_idx'),
+            models.Index(fields=['user', 'updated_at'], name='battery_type_user_upd_idx'),  # MAX(updated_at)
+        ]
 
     # string representation
     def __str__(self):
@@ -19,34 +126,103 @@ class BatteryType(models.Model):
         return self.type
 
 
-class Device(models.Model):
+class Device(BatteryRow):
     description = models.CharField(max_length=100)
     battery_type = models.ForeignKey(BatteryType, on_delete=models.CASCADE)
     battery_qty = models.PositiveSmallIntegerField(validators=[MinValueValidator(1), MaxValueValidator(10)])
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    # Total nb of batteries assigned to this device (sum of the battery_qty of its BatteryAssignment)
+    # Maintained by the signals in battery/signals.py, rebuilt with "./manage.py rebuild_assigned_qty"
+    assigned_qty = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Time of the last change, including the changes of assigned_qty
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DeviceQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'battery_type'], name='battery_dev_user_type_idx'),    # filter on type
+            models.Index(fields=['user', 'description'], name='battery_dev_user_desc_idx'),    # lookup by name
+            models.Index(fields=['user', 'updated_at'], name='battery_dev_user_upd_idx'),
+        ]
 
     # string representation
     def __str__(self):
         return "%s (%sx %s)" % (self.description, self.battery_qty, self.battery_type)
 
+    # nb of batteries which can still be assigned to this device
+    @property
+    def free_qty(self):
+        return max(self.battery_qty - self.assigned_qty, 0)
 
-class BatteryModel(models.Model):
+
+class BatteryModel(BatteryRow):
     description = models.CharField(max_length=100)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BatteryModelQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'description'], name='battery_model_user_desc_idx'),
+            models.Index(fields=['user', 'updated_at'], name='battery_model_user_upd_idx'),
+        ]
 
     # string representation
     def __str__(self):
         return self.description
 
 
-class BatteryAssignment(models.Model):
+class BatteryAssignment(BatteryRow):
     device = models.ForeignKey(Device, on_delete=models.CASCADE)
     battery_model = models.ForeignKey(BatteryModel, on_delete=models.CASCADE)
     # todo: limit the MaxValue to the battery_qty of the associated Device
     # battery_qty = models.PositiveSmallIntegerField(validators=[MinValueValidator(1), MaxValueValidator(10)])
     battery_qty = models.PositiveSmallIntegerField()
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BatteryAssignmentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'device'], name='battery_asg_user_device_idx'),    # capacity check
+            models.Index(fields=['user', 'battery_model'], name='battery_asg_user_model_idx'),  # filter on model
+            models.Index(fields=['user', 'updated_at'], name='battery_asg_user_upd_idx'),
+        ]
+
+    # The device and battery_qty as stored in the DB, i.e., as counted in Device.assigned_qty
+    # Used by the signals in battery/signals.py to update the counter of the device when the assignment changes
+    _counted = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'device_id' in instance.__dict__ and 'battery_qty' in instance.__dict__:   # fields not deferred
+            instance._counted = (instance.device_id, instance.battery_qty)
+        return instance
 
     # string representation
     def __str__(self):
         return "%s (%sx %s)" % (self.device, self.battery_qty, self.battery_model)
+
+
+class SearchEntry(models.Model):
+    # Text of a battery type, battery model, device or assignment, indexed for the search of the users
+    # Maintained by the signals in battery/signals.py, rebuilt with "./manage.py rebuild_search_index"
+    # The full-text index is created by the migration for each DB: FTS5 table on SQLite, GIN index on PostgreSQL
+    # (see battery/search.py)
+    # On SQLite, a migration which rebuilds the table battery_searchentry drops its FTS5 triggers: create them again
+    KINDS = [('type', 'Battery type'), ('model', 'Battery model'), ('device', 'Device'),
+             ('assignment', 'Battery assignment')]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.PositiveIntegerField()
+    text = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='battery_search_kind_object_uniq'),
+        ]
@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+#
+# Keyset (cursor) pagination ordered by primary key
+#
+# Unlike OFFSET pagination, the cost of a page does not depend on its depth: a page is fetched with
+#   WHERE pk > <after> ORDER BY pk LIMIT <size + 1>
+# The extra row fetched tells whether there is another page after this one.
+#
+# The cursors are passed in the GET parameters of the index pages:
+# - after=<pk>  : show the page of rows with a primary key greater than pk (next page)
+# - before=<pk> : show the page of rows with a primary key lower than pk (previous page)
+# - size=<n>    : number of rows per page
+#
+
+# GET parameters which must not be propagated to the links of the pagination
+PAGINATION_PARAMS = ('after', 'before', 'csrfmiddlewaretoken')
+
+# Largest value of the integer columns of the DBs (signed 64 bits): a larger cursor cannot be compared with the
+# primary keys (SQLite raises OverflowError)
+MAX_INT = 2 ** 63 - 1
+
+
+def _get_int(params, name, default=None):
+    # Return the GET parameter 'name' as a positive integer, or 'default' if it is missing or not valid
+    try:
+        value = int(params.get(name, ''))
+    except ValueError:
+        return default
+    return value if 0 < value <= MAX_INT else default
+
+
+class KeysetPage:
+    # A page of a QuerySet. The rows are only fetched from the DB when the page is first accessed,
+    # so that a template which does not render the page does not run the query
+
+    def __init__(self, queryset, params, after=None, before=None, size=None):
+        self.queryset = queryset
+        self.params = params    # GET parameters of the request, used to build the links to the other pages
+        self.after = after
+        self.before = before
+        self.size = size or settings.BATTERY_PAGE_SIZE
+
+    @cached_property
+    def _rows(self):
+        # Fetch one more row than the size of the page to know whether there is a page beyond this one
+        if self.before:
+            rows = list(self.queryset.filter(pk__lt=self.before).order_by('-pk')[:self.size + 1])
+            more = len(rows) > self.size
+            return rows[:self.size][::-1], more
+        elif self.after:
+            rows = list(self.queryset.filter(pk__gt=self.after).order_by('pk')[:self.size + 1])
+        else:
+            rows = list(self.queryset.order_by('pk')[:self.size + 1])
+        more = len(rows) > self.size
+        return rows[:self.size], more
+
+    @property
+    def object_list(self):
+        return self._rows[0]
+
+    @property
+    def has_next(self):
+        # Going backward, there is always a next page: the one we came from
+        return bool(self.before) or self._rows[1]
+
+    @property
+    def has_previous(self):
+        # Going forward, there is always a previous page: the one we came from
+        return self._rows[1] if self.before else bool(self.after)
+
+    def _query(self, **cursor):
+        # Build the query string of a link to another page, keeping the filters and the page size
+        params = self.params.copy()
+        for name in PAGINATION_PARAMS:
+            params.pop(name, None)
+        for name, value in cursor.items():
+            params[name] = value    # QueryDict.update() would append to the existing values
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query(after=self.object_list[-1].pk) if self.has_next and self.object_list else ''
+
+    @property
+    def previous_query(self):
+        return self._query(before=self.object_list[0].pk) if self.has_previous and self.object_list else ''
+
+    def size_query(self, size):
+        # Link to the first page with another page size
+        return self._query(size=size)
+
+    @property
+    def size_choices(self):
+        return [(size, self.size_query(size)) for size in settings.BATTERY_PAGE_SIZE_CHOICES]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def paginate(request, queryset):
+    # Return the page of the queryset requested by the GET parameters 'after', 'before' and 'size'
+    size = min(_get_int(request.GET, 'size', settings.BATTERY_PAGE_SIZE), settings.BATTERY_MAX_PAGE_SIZE)
+    return KeysetPage(queryset, request.GET, after=_get_int(request.GET, 'after'),
+                      before=_get_int(request.GET, 'before'), size=size)
+
+
+class EstimatedCountPaginator(Paginator):
+    # Paginator of the admin changelists which does not count the rows of a whole (unfiltered) table
+    # On PostgreSQL, COUNT(*) scans the whole table: the estimate of the nb of rows maintained by ANALYZE/VACUUM
+    # (pg_class.reltuples) is used instead when it is above ESTIMATE_THRESHOLD rows.
+    # The filtered changelists and the other DB backends use an exact COUNT(*)
+    ESTIMATE_THRESHOLD = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not getattr(queryset, 'query', None) or queryset.query.where:
+            return super().count
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return super().count
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        estimate = int(row[0]) if row else 0
+        return estimate if estimate > self.ESTIMATE_THRESHOLD else super().count
@@ -0,0 +1,94 @@
+import time
+
+from django.db import router
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest, Now
+
+from accounts.models import CustomUser
+from battery.models import BatteryType, BatteryModel, Device, BatteryAssignment
+
+#
+# Query helpers shared by the views
+#
+
+
+def assigned_qty_subquery():
+    # Total nb of batteries assigned to the device of the outer query, computed from the BatteryAssignment
+    assigned = BatteryAssignment.objects.filter(device=OuterRef('pk')).order_by().values('device')
+    return Coalesce(Subquery(assigned.annotate(total=Sum('battery_qty')).values('total')), 0)
+
+
+def refresh_assigned_qty(devices=None):
+    # Recompute Device.assigned_qty from the BatteryAssignment with a single UPDATE
+    # 'devices' is a QuerySet of the devices to update (default: all devices)
+    # Needed after bulk operations which do not send the signals maintaining the counter (see battery/signals.py)
+    # Return the nb of devices updated
+    devices = Device.objects.all() if devices is None else devices
+    return devices.update(assigned_qty=assigned_qty_subquery(), updated_at=Now())
+
+
+def wrong_assigned_qty(devices=None):
+    # Return a QuerySet of the devices whose assigned_qty does not match their BatteryAssignment
+    devices = Device.objects.all() if devices is None else devices
+    return devices.annotate(actual_qty=assigned_qty_subquery()).exclude(assigned_qty=F('actual_qty'))
+
+
+def inventory_summary(user):
+    # Return the overview of the inventory of the user, computed with one GROUP BY query per table:
+    # - 'assignments': per (battery type, battery model), the nb of assignments, of devices and of batteries
+    # - 'devices': per battery type (id and type), the nb of devices, their battery capacity, the nb of batteries
+    #   assigned (Device.assigned_qty) and the nb of devices which can still receive batteries
+    # The device figures are not computed in the GROUP BY of the assignments: the join of the devices with their
+    # assignments repeats a device once per assignment (and drops the devices without any), so the sums of the
+    # capacities would be wrong. Two queries, whose cost does not depend on the nb of rows, keep them exact
+    # The result only contains plain values so that it can be cached
+    assignments = list(BatteryAssignment.objects.for_user(user)
+                       .values(type=F('device__battery_type__type'), model=F('battery_model__description'))
+                       .annotate(assignment_count=Count('pk'), device_count=Count('device', distinct=True),
+                                 battery_total=Sum('battery_qty'))
+                       .order_by('type', 'model'))
+    devices = list(Device.objects.for_user(user)
+                   .values('battery_type', type=F('battery_type__type'))
+                   .annotate(device_count=Count('pk'), capacity=Sum('battery_qty'), assigned=Sum('assigned_qty'),
+                             free=Sum(Greatest(F('battery_qty') - F('assigned_qty'), 0, output_field=IntegerField())),
+                             free_device_count=Count('pk', filter=Q(assigned_qty__lt=F('battery_qty'))))
+                   .order_by('type'))
+    return {'assignments': assignments, 'devices': devices}
+
+
+def inventory_fingerprint(user):
+    # Return the nb of rows and the time of the last change of each table of the inventory of the user, and the
+    # time of the last change of the whole inventory, in one query (one subquery per table on the (user, updated_at)
+    # indexes). The nb of rows tells about the deletions, which do not leave any updated_at behind
+    # Return a tuple (fingerprint, last_modified), 'last_modified' is None if the inventory is empty
+    annotations = {}
+    for model in (BatteryType, BatteryModel, Device, BatteryAssignment):
+        rows = model.objects.filter(user=OuterRef('pk')).order_by().values('user')
+        name = model._meta.model_name
+        annotations[f'{name}_count'] = Subquery(rows.annotate(count=Count('pk')).values('count'))
+        annotations[f'{name}_updated'] = Subquery(rows.annotate(updated=Max('updated_at')).values('updated'))
+    # Read from the DB which serves the battery tables, like the page (the replica, if any, see battery/routers.py).
+    # From the primary when the user is not replicated yet
+    queryset = CustomUser.objects.filter(pk=user.pk).annotate(**annotations).values(*annotations)
+    values = queryset.using(router.db_for_read(BatteryType)).first() or queryset.using('default').get()
+    updated = [value for name, value in values.items() if name.endswith('_updated') and value is not None]
+    return tuple(values.values()), max(updated, default=None)
+
+
+class QueryRecorder:
+    # Wrapper installed with connection.execute_wrapper() to record the SQL, parameters and duration of the queries
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - start))
+
+    @property
+    def duration(self):
+        # Total time spent in the DB, in seconds
+        return sum(duration for sql, params, duration in self.queries)
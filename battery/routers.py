@@ -0,0 +1,107 @@
+import contextvars
+import time
+
+from django.conf import settings
+from django.db import connections
+
+#
+# Read replica of the primary database ('default'), when the 'replica' database is configured (see config/settings.py)
+#
+# ReplicaRouter sends the reads of the battery tables to the replica only when PrimaryPinningMiddleware allows it:
+# - for GET and HEAD requests: the pages, the filter forms and their choices, the summary
+# - unless the client wrote to the battery tables during the last BATTERY_REPLICA_STICKY_SECONDS: the replica
+#   may lag behind the primary, and users must see the data they just saved. The deadline is kept in a signed
+#   cookie, which is sent with the next requests whichever worker process serves them
+# - unless the data read is about to be cached (see battery/cache.py): the cached data would otherwise keep the
+#   lag of the replica for the whole timeout of the cache, read_primary() sends the reads to the primary
+# Everything else reads from the primary:
+# - the form submissions (POST), including the capacity check of clean_battery_qty()
+# - the reads in a transaction (atomic block), which must see the writes of the transaction
+# - the reads following a write in the same request
+# - the content of the streaming exports, which is generated after the middleware
+# - the other apps (users, sessions), the management commands, the shell and the tests
+# All the writes go to the primary.
+#
+
+REPLICA = 'replica'
+
+# Signed cookie: time until which the reads of the client go to the primary
+STICKY_COOKIE = 'battery_primary_until'
+
+# Whether the reads of the current request may go to the replica
+_read_replica = contextvars.ContextVar('battery_read_replica', default=False)
+# Whether the current request wrote to the battery tables
+_written = contextvars.ContextVar('battery_written', default=False)
+
+
+def replica():
+    # Alias of the replica, None when there is no replica
+    return REPLICA if REPLICA in settings.DATABASES else None
+
+
+def reading_replica():
+    # Whether the reads of the battery tables of the current request may go to the replica
+    return bool(replica()) and _read_replica.get()
+
+
+def read_primary():
+    # Send the next reads of the current request to the primary
+    _read_replica.set(False)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'battery':
+            return None
+        if replica() and _read_replica.get() and not connections['default'].in_atomic_block:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == 'battery':
+            # The next reads of the request, and of the session for a while, go to the primary
+            _read_replica.set(False)
+            _written.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        if {obj1._state.db, obj2._state.db} <= {'default', REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is migrated by the replication
+        if db == REPLICA:
+            return False
+        return None
+
+
+class PrimaryPinningMiddleware:
+    # Allow the reads of the request to go to the replica, and pin the client to the primary after a write
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica():
+            return self.get_response(request)
+
+        try:
+            sticky = float(request.get_signed_cookie(STICKY_COOKIE, 0, salt=STICKY_COOKIE)) > time.time()
+        except ValueError:
+            sticky = False
+        read_token = _read_replica.set(request.method in ('GET', 'HEAD') and not sticky)
+        written_token = _written.set(False)
+        try:
+            response = self.get_response(request)
+            if _written.get():
+                response.set_signed_cookie(
+                    STICKY_COOKIE, str(time.time() + settings.BATTERY_REPLICA_STICKY_SECONDS), salt=STICKY_COOKIE,
+                    max_age=settings.BATTERY_REPLICA_STICKY_SECONDS, secure=settings.SESSION_COOKIE_SECURE,
+                    httponly=True, samesite='Lax')
+        finally:
+            _read_replica.reset(read_token)
+            _written.reset(written_token)
+        return response
@@ -0,0 +1,123 @@
+import re
+
+from django.db import connections, router
+
+from battery.models import BatteryType, BatteryModel, Device, BatteryAssignment, SearchEntry
+
+#
+# Full-text search of the inventory of a user
+#
+# Each battery type, battery model, device and assignment has a SearchEntry holding its searchable text, indexed
+# by the DB (see the migration 0012_searchentry):
+# - SQLite: FTS5 table of the user and the text
+# - PostgreSQL: GIN index on to_tsvector('simple', text)
+# - other DBs: substring search, not indexed
+# The words of a search are matched as whole words, except the last one which is matched as a prefix (it may not be
+# typed entirely). The most recent entries come first: an entry is recreated when its object changes.
+# The results are not ordered by relevance: bm25() and ts_rank() read the statistics of each word in all the
+# matching entries, which takes hundreds of ms on large inventories whose common words (device, battery) match
+# most entries, while the newest matches are read directly from the index.
+# The entries are maintained by the signals in battery/signals.py. The bulk operations, which do not send signals,
+# call index_new() (after bulk_create()) or reindex() (after bulk_update()).
+#
+
+# kind of SearchEntry -> model and the fields of its searchable text
+SEARCHED = {
+    'type': (BatteryType, ('type', 'description')),
+    'model': (BatteryModel, ('description',)),
+    'device': (Device, ('description',)),
+    'assignment': (BatteryAssignment, ('device__description', 'battery_model__description')),
+}
+KINDS = {model: kind for kind, (model, fields) in SEARCHED.items()}
+
+BATCH_SIZE = 1000
+
+
+def _index(model, objects):
+    # (Re)create the entries of the objects of the QuerySet 'objects' of 'model'
+    # Return the nb of entries created
+    kind = KINDS[model]
+    fields = SEARCHED[kind][1]
+    rows = list(objects.order_by().values_list('pk', 'user_id', *fields))
+    SearchEntry.objects.filter(kind=kind, object_id__in=[row[0] for row in rows]).delete()
+    SearchEntry.objects.bulk_create(
+        (SearchEntry(kind=kind, object_id=pk, user_id=user_id, text=' '.join(value for value in values if value))
+         for pk, user_id, *values in rows), batch_size=BATCH_SIZE)
+    return len(rows)
+
+
+def reindex(model, pks):
+    # Update the entries of the objects of 'model' whose primary keys are 'pks', after they changed
+    # The text of an assignment holds the descriptions of its device and battery model: update it too
+    _index(model, model.objects.filter(pk__in=pks))
+    if model is Device:
+        _index(BatteryAssignment, BatteryAssignment.objects.filter(device__in=pks))
+    elif model is BatteryModel:
+        _index(BatteryAssignment, BatteryAssignment.objects.filter(battery_model__in=pks))
+
+
+def unindex(model, pks):
+    SearchEntry.objects.filter(kind=KINDS[model], object_id__in=pks).delete()
+
+
+def index_new(user_ids):
+    # Create the missing entries of the users, after objects were created without signals (bulk_create())
+    for kind, (model, fields) in SEARCHED.items():
+        indexed = SearchEntry.objects.filter(kind=kind).values('object_id')
+        _index(model, model.objects.filter(user__in=user_ids).exclude(pk__in=indexed))
+
+
+def rebuild(user_ids):
+    # Recreate all the entries of the users. Return the nb of entries
+    SearchEntry.objects.filter(user__in=user_ids).delete()
+    return sum(_index(model, model.objects.filter(user__in=user_ids)) for model, fields in SEARCHED.values())
+
+
+def optimize():
+    # Merge the segments of the FTS5 index after many writes (SQLite only)
+    connection = connections[router.db_for_write(SearchEntry)]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO battery_searchentry_fts(battery_searchentry_fts) VALUES ('optimize')")
+
+
+def search(user, text, limit):
+    # Return the (kind, object_id) of the entries of the user matching all the words of 'text', newest first
+    words = re.findall(r'\w+', text)
+    if not words:
+        return []
+    connection = connections[router.db_for_read(SearchEntry)]
+    if connection.vendor == 'sqlite':
+        # The words are quoted: the FTS5 syntax typed by the user is not interpreted
+        sql = """SELECT e.kind, e.object_id FROM battery_searchentry_fts f
+                 JOIN battery_searchentry e ON e.id = f.rowid
+                 WHERE battery_searchentry_fts MATCH %s ORDER BY f.rowid DESC LIMIT %s"""
+        query = ' '.join(f'"{word}"' for word in words) + '*'
+        params = [f'user_id : "{user.pk}" AND text : ({query})', limit]
+    elif connection.vendor == 'postgresql':
+        sql = """SELECT kind, object_id FROM battery_searchentry
+                 WHERE user_id = %s AND to_tsvector('simple', text) @@ to_tsquery('simple', %s)
+                 ORDER BY id DESC LIMIT %s"""
+        params = [user.pk, ' & '.join(words) + ':*', limit]
+    else:
+        entries = SearchEntry.objects.using(connection.alias).filter(user=user)
+        for word in words:
+            entries = entries.filter(text__icontains=word)
+        return list(entries.order_by('-pk').values_list('kind', 'object_id')[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search_results(user, text, limit):
+    # Return the objects matching 'text' as a list of (kind, object), newest first
+    # The objects are read with one query per kind
+    matches = search(user, text, limit)
+    objects = {}
+    for kind, (model, fields) in SEARCHED.items():
+        pks = [pk for kind_, pk in matches if kind_ == kind]
+        if pks:
+            objects[kind] = model.objects.for_user(user).in_bulk(pks)
+    # An entry whose object was just deleted by a concurrent request is skipped
+    return [(kind, objects[kind][pk]) for kind, pk in matches if pk in objects[kind]]
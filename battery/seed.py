@@ -0,0 +1,47 @@
+from django.conf import settings
+
+from battery import search
+from battery.cache import invalidate_choices, invalidate_inventory
+from battery.models import BatteryType, BatteryModel
+
+#
+# Seed data: the battery types and battery models created for each new user (settings.BATTERY_SEED_DATA)
+#
+# The seed rows are identified by their natural key (BatteryType.type, BatteryModel.description): only the rows
+# a user does not have yet are created, so seeding a user twice does not create duplicates.
+# All rows are created with bulk_create(), i.e. one INSERT per model whatever the nb of users.
+#
+
+# model -> (key of the model in BATTERY_SEED_DATA, natural key field)
+SEED_MODELS = {
+    BatteryType: ('types', 'type'),
+    BatteryModel: ('models', 'description'),
+}
+
+
+def seed_users(users):
+    # Create the missing seed rows of the users. Return the nb of rows created for each model
+    user_ids = [user.pk for user in users]
+    created = {}
+    for model, (name, field) in SEED_MODELS.items():
+        rows = settings.BATTERY_SEED_DATA.get(name, [])
+        # Natural keys of the seed rows the users already have (one query)
+        existing = set(model.objects.filter(user_id__in=user_ids, **{f'{field}__in': [row[field] for row in rows]})
+                       .values_list('user_id', field))
+        instances = [model(user_id=user_id, **row) for user_id in user_ids for row in rows
+                     if (user_id, row[field]) not in existing]
+        model.objects.bulk_create(instances)
+        created[model._meta.model_name] = len(instances)
+
+        # bulk_create() does not send the signals which evict the cached choices of the forms
+        for user_id in {instance.user_id for instance in instances}:
+            invalidate_choices(model, user_id)
+            invalidate_inventory(user_id)
+    # ... nor the signals which index the new rows for the search
+    if any(created.values()):
+        search.index_new(user_ids)
+    return created
+
+
+def seed_user(user):
+    return seed_users([user])
@@ -0,0 +1,126 @@
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Now
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
+
+from battery import search
+from battery.cache import invalidate_choices, invalidate_inventory
+from battery.models import BatteryType, Device, BatteryModel, BatteryAssignment, rows_deleting
+
+#
+# Signal receivers, connected when the app is ready (see apps.py)
+#
+# The deletions send a single rows_deleting signal with all the rows deleted, in cascade too, instead of
+# pre_delete/post_delete for each row (see battery/models.py): no receiver must be connected to pre_delete/post_delete
+# of the models of the inventory
+#
+
+#
+# Device.assigned_qty: total nb of batteries assigned to a device
+#
+# The counter is updated atomically in the DB with F() expressions when a BatteryAssignment is saved or deleted,
+# so that concurrent requests do not overwrite each other's updates.
+# BatteryAssignment._counted holds the (device_id, battery_qty) of the assignment which is counted in the DB.
+#
+# Bulk operations (bulk_create(), QuerySet.update()) do not send signals: the counters of the devices must then
+# be rebuilt with battery.queries.refresh_assigned_qty()
+#
+
+
+def _add_assigned_qty(device_id, qty):
+    if qty:
+        Device.objects.filter(pk=device_id).update(assigned_qty=F('assigned_qty') + qty, updated_at=Now())
+
+
+@receiver(pre_save, sender=BatteryAssignment)
+def assignment_pre_save(sender, instance, raw, **kwargs):
+    # An assignment which was not loaded from the DB may still be an update (primary key set by the caller):
+    # retrieve what is currently counted for it
+    if not raw and instance._counted is None and instance.pk is not None:
+        instance._counted = BatteryAssignment.objects.filter(pk=instance.pk).values_list(
+            'device_id', 'battery_qty').first()
+
+
+@receiver(post_save, sender=BatteryAssignment)
+def assignment_post_save(sender, instance, raw, **kwargs):
+    if raw:  # loaddata: the counters are part of the fixture
+        return
+    counted = (instance.device_id, instance.battery_qty)
+    if instance._counted is None:   # new assignment
+        _add_assigned_qty(instance.device_id, instance.battery_qty)
+    elif instance._counted[0] == instance.device_id:    # same device, only the quantity may have changed
+        _add_assigned_qty(instance.device_id, instance.battery_qty - instance._counted[1])
+    else:   # the assignment was moved to another device
+        _add_assigned_qty(instance._counted[0], -instance._counted[1])
+        _add_assigned_qty(instance.device_id, instance.battery_qty)
+    instance._counted = counted
+
+
+@receiver(rows_deleting)
+def assignments_deleting(sender, deleted, **kwargs):
+    # The batteries of the deleted assignments are no longer counted by their devices (one UPDATE), unless the
+    # devices are deleted too
+    assignments = deleted.get(BatteryAssignment)
+    if assignments is None:
+        return
+    devices = Device.objects.filter(pk__in=assignments.values('device'))
+    if Device in deleted:
+        devices = devices.exclude(pk__in=deleted[Device].values('pk'))
+    counted = (assignments.filter(device=OuterRef('pk')).order_by().values('device')
+               .annotate(qty=Sum('battery_qty')).values('qty'))
+    devices.update(assigned_qty=F('assigned_qty') - Subquery(counted), updated_at=Now())
+
+
+#
+# Cached choices of the forms (see battery/cache.py)
+#
+
+@receiver(post_save, sender=BatteryType)
+@receiver(post_save, sender=BatteryModel)
+@receiver(post_save, sender=Device)
+def choices_changed(sender, instance, **kwargs):
+    invalidate_choices(sender, instance.user_id)
+    if sender is BatteryType:   # the label of a Device shows its battery type
+        invalidate_choices(Device, instance.user_id)
+
+
+#
+# Cached overview of the inventory (see battery/cache.py)
+#
+
+@receiver(post_save, sender=BatteryType)
+@receiver(post_save, sender=BatteryModel)
+@receiver(post_save, sender=Device)
+@receiver(post_save, sender=BatteryAssignment)
+def inventory_changed(sender, instance, **kwargs):
+    invalidate_inventory(instance.user_id)
+
+
+@receiver(rows_deleting)
+def inventory_deleting(sender, deleted, **kwargs):
+    # The rows deleted in cascade belong to the users of the rows deleted
+    for user_id in deleted[sender].order_by().values_list('user', flat=True).distinct():
+        for model in deleted:
+            if model is not BatteryAssignment:
+                invalidate_choices(model, user_id)
+        invalidate_inventory(user_id)
+
+
+#
+# Full-text search entries (see battery/search.py)
+#
+
+@receiver(post_save, sender=BatteryType)
+@receiver(post_save, sender=BatteryModel)
+@receiver(post_save, sender=Device)
+@receiver(post_save, sender=BatteryAssignment)
+def search_entry_saved(sender, instance, raw, **kwargs):
+    if raw:  # loaddata: the index is rebuilt with "./manage.py rebuild_search_index"
+        return
+    search.reindex(sender, [instance.pk])
+
+
+@receiver(rows_deleting)
+def search_entries_deleting(sender, deleted, **kwargs):
+    for model, rows in deleted.items():
+        search.unindex(model, rows.values('pk'))
@@ -0,0 +1,61 @@
+import random
+
+from battery import search
+from battery.cache import invalidate_choices, invalidate_inventory
+from battery.models import BatteryType, BatteryModel, Device, BatteryAssignment
+from battery.queries import refresh_assigned_qty
+
+#
+# Generation of synthetic inventories, used to measure the queries of the views on a realistic volume of data
+#
+# All rows are created with bulk_create(). Since SQLite does not return the primary keys of the rows
+# inserted with bulk_create(), the rows are read back from the DB when their primary keys are needed.
+#
+
+
+def generate_inventory(user, types=5, models=5, devices=1000, assignments=2000, batch_size=1000, seed=0):
+    # Create battery types, battery models, devices and battery assignments for the user
+    # The assignments never exceed the battery capacity of their device
+    # Return a dict with the nb of rows created for each model
+    rnd = random.Random(seed)
+
+    BatteryType.objects.bulk_create(
+        [BatteryType(type=f'T{i}', description=f'Battery type {i}', user=user) for i in range(types)],
+        batch_size=batch_size)
+    type_ids = list(BatteryType.objects.filter(user=user).values_list('pk', flat=True))
+
+    BatteryModel.objects.bulk_create(
+        [BatteryModel(description=f'Battery model {i}', user=user) for i in range(models)],
+        batch_size=batch_size)
+    model_ids = list(BatteryModel.objects.filter(user=user).values_list('pk', flat=True))
+
+    Device.objects.bulk_create(
+        [Device(description=f'Device {i}', battery_type_id=rnd.choice(type_ids), battery_qty=rnd.randint(1, 10),
+                user=user) for i in range(devices)],
+        batch_size=batch_size)
+    # Remaining battery capacity of each device
+    free = dict(Device.objects.filter(user=user).values_list('pk', 'battery_qty'))
+
+    # Assign batteries to the devices one after the other, as long as they have some free capacity
+    rows = []
+    while len(rows) < assignments and free:
+        for device_id in list(free):
+            qty = rnd.randint(1, free[device_id])
+            rows.append(BatteryAssignment(device_id=device_id, battery_model_id=rnd.choice(model_ids),
+                                          battery_qty=qty, user=user))
+            free[device_id] -= qty
+            if not free[device_id]:
+                del free[device_id]
+            if len(rows) == assignments:
+                break
+    BatteryAssignment.objects.bulk_create(rows, batch_size=batch_size)
+    # bulk_create() does not send the signals which maintain Device.assigned_qty
+    refresh_assigned_qty(Device.objects.filter(user=user))
+    # ... nor the signals which index the new rows for the search
+    search.index_new([user.pk])
+    # ... nor the signals which evict the cached data of the user
+    for model in (BatteryType, BatteryModel, Device):
+        invalidate_choices(model, user.pk)
+    invalidate_inventory(user.pk)
+
+    return {'types': len(type_ids), 'models': len(model_ids), 'devices': devices, 'assignments': len(rows)}
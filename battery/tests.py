@@ -1,11 +1,826 @@
-from django.test import TestCase
+import json
+import sqlite3
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.signing import get_cookie_signer
+from django.db import connection
+from django.db.utils import load_backend
+from django.http import HttpResponse, QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# https://python.doctor/page-django-query-set-queryset-manager
-from battery.models import Device
+from accounts.models import CustomUser
+from battery.cache import get_choices, invalidate_choices, table_cache
+from battery.models import BatteryType, BatteryModel, Device, BatteryAssignment, SearchEntry
+from battery.queries import inventory_summary, wrong_assigned_qty
+from battery.routers import STICKY_COOKIE, PrimaryPinningMiddleware, ReplicaRouter
+from battery.search import search
 
-# _test = Device.objects.filter(user=request.user, description='jdoe Dev2').values()
-res = Device.objects.filter(description='jdoe Dev2')
-res
-res.values()
\ No newline at end of file
+
+def create_inventory(user, nb_devices):
+    # Create one battery type, one battery model and 'nb_devices' devices with one assignment each
+    battery_type = BatteryType.objects.create(type='AA', user=user)
+    battery_model = BatteryModel.objects.create(description='Rechargeable 1.2V', user=user)
+    for i in range(nb_devices):
+        dev = Device.objects.create(description=f'Device {i}', battery_type=battery_type, battery_qty=2, user=user)
+        BatteryAssignment.objects.create(device=dev, battery_model=battery_model, battery_qty=1, user=user)
+    return battery_type, battery_model
+
+
+def clear_choices(user):
+    # Evict the cached choices of the forms, but not the sessions which may be cached too (cached_db)
+    for model in (BatteryType, BatteryModel, Device):
+        invalidate_choices(model, user.pk)
+
+
+class BatteryTestCase(TestCase):
+    # Log in a new user. The cache is cleared since it is not rolled back between the tests
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='jdoe', email='jdoe@example.com', password='secret')
+        self.client.force_login(self.user)
+
+
+class AssignmentIndexTests(BatteryTestCase):
+
+    def count_queries(self, params=None):
+        # Return the nb of SQL queries needed to render the assignment index page
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('battery:assignment'), params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_row_count(self):
+        battery_type, battery_model = create_inventory(self.user, 1)
+        few = self.count_queries()
+        few_filtered = self.count_queries({'battery_type': battery_type.pk, 'battery_model': battery_model.pk})
+
+        create_inventory(self.user, 20)
+        clear_choices(self.user)    # same state of the cached filter choices as for the first request
+        self.assertEqual(self.count_queries(), few)
+        self.assertEqual(self.count_queries({'battery_type': battery_type.pk, 'battery_model': battery_model.pk}),
+                         few_filtered)
+
+    def test_filter_choices_are_cached(self):
+        battery_type, battery_model = create_inventory(self.user, 1)
+        cold = self.count_queries()
+        # no query for the battery types and models, nor for the table which is cached too
+        self.assertEqual(self.count_queries(), cold - 4)
+
+        # A new battery type evicts the cached battery types, which are then shown with the new one
+        BatteryType.objects.create(type='C', user=self.user)
+        self.assertEqual(self.count_queries(), cold - 1)
+        response = self.client.get(reverse('battery:assignment'))
+        self.assertContains(response, '>C</option>')
+
+    def test_choices_are_evicted_again_after_the_commit(self):
+        # The tests run in a transaction which is never committed: the callbacks of on_commit() are run by hand
+        with mock.patch('battery.cache.transaction.on_commit') as on_commit:
+            BatteryType.objects.create(type='C', user=self.user)
+        get_choices(BatteryType, self.user)     # cached by another request before the commit
+        for callback, in (call.args for call in on_commit.call_args_list):
+            callback()
+        with self.assertNumQueries(1):
+            get_choices(BatteryType, self.user)
+
+    def test_invalid_filter_shows_all_assignments(self):
+        create_inventory(self.user, 2)
+        response = self.client.get(reverse('battery:assignment'), {'battery_type': '999999'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Device 1')
+
+
+class ForUserTests(BatteryTestCase):
+
+    def test_rows_are_rendered_in_one_query(self):
+        create_inventory(self.user, 3)
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        create_inventory(other, 2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(len([str(assignment) for assignment in
+                                  BatteryAssignment.objects.for_user(self.user).for_list()]), 3)
+        with self.assertNumQueries(1):
+            self.assertEqual([device.free_qty for device in Device.objects.for_user(self.user).for_list()], [1] * 3)
+        self.assertEqual(Device.objects.for_user(self.user).totals(), {'count': 3, 'battery_total': 6})
+        self.assertEqual(BatteryType.objects.for_user(other).totals(), {'count': 1})
+
+    def test_device_index_query_count_does_not_depend_on_row_count(self):
+        create_inventory(self.user, 1)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('battery:device'))
+
+        # Devices of several battery types: each row shows its battery type
+        for type_ in ('C', 'D', '9V'):
+            battery_type = BatteryType.objects.create(type=type_, user=self.user)
+            Device.objects.create(description=type_, battery_type=battery_type, battery_qty=1, user=self.user)
+        clear_choices(self.user)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('battery:device'))
+        self.assertContains(response, '<td>9V</td>')
+        self.assertEqual(len(many.captured_queries), len(few.captured_queries))
+
+
+class PaginationTests(BatteryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.battery_type, self.battery_model = create_inventory(self.user, 5)
+
+    def test_keyset_pages_cover_all_rows(self):
+        params = {'battery_type': self.battery_type.pk, 'battery_model': '0', 'size': 2}
+        seen = []
+        while True:
+            response = self.client.get(reverse('battery:assignment'), params)
+            page = response.context['page']
+            # The headline and the total cover the whole filtered set, not only the page
+            self.assertEqual(response.context['totals']['count'], 5)
+            self.assertEqual(response.context['totals']['battery_total'], 5)
+            seen += [assignment.pk for assignment in page]
+            if not page.has_next:
+                break
+            params = dict(QueryDict(page.next_query).items())
+            # The filters are kept in the links to the next page
+            self.assertEqual(params['battery_type'], str(self.battery_type.pk))
+
+        self.assertEqual(seen, sorted(BatteryAssignment.objects.values_list('pk', flat=True)))
+
+    def test_previous_page(self):
+        last = Device.objects.order_by('pk').last()
+        response = self.client.get(reverse('battery:device'), {'before': last.pk, 'size': 2})
+        page = response.context['page']
+        self.assertEqual([device.description for device in page], ['Device 2', 'Device 3'])
+        self.assertTrue(page.has_previous)
+        self.assertTrue(page.has_next)
+
+    def test_invalid_cursors_show_the_first_page(self):
+        for params in ({'after': 'x'}, {'after': '-1'}, {'after': 10 ** 23}, {'before': 2 ** 63}):
+            response = self.client.get(reverse('battery:device'), params)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.context['page'].has_previous)
+            self.assertEqual(len(response.context['page']), 5)
+
+
+class AssignmentCapacityTests(BatteryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.battery_type, self.battery_model = create_inventory(self.user, 1)  # 'Device 0' has 1 battery of 2
+        self.device = Device.objects.get(user=self.user)
+        self.assignment = BatteryAssignment.objects.get(user=self.user)
+
+    def post(self, url, device, qty):
+        return self.client.post(url, {'device': device.pk, 'battery_model': self.battery_model.pk,
+                                       'battery_qty': qty})
+
+    def test_create_within_capacity(self):
+        response = self.post(reverse('battery:assignment_create'), self.device, 2)
+        self.assertContains(response, 'No more than 1 battery can be assigned to this device.')
+        response = self.post(reverse('battery:assignment_create'), self.device, 1)
+        self.assertRedirects(response, reverse('battery:assignment'))
+        self.assertEqual(BatteryAssignment.objects.filter(device=self.device).count(), 2)
+
+    def test_update_does_not_count_the_assignment_being_updated(self):
+        url = reverse('battery:assignment_detail', args=[self.assignment.pk])
+        self.assertEqual(self.post(url, self.device, 3).status_code, 200)
+        self.assertRedirects(self.post(url, self.device, 2), reverse('battery:assignment'))
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.battery_qty, 2)
+
+    def test_devices_with_the_same_description(self):
+        # The capacity of the device selected in the form is checked, not the one of a device with the same name
+        other = Device.objects.create(description=self.device.description, battery_type=self.battery_type,
+                                      battery_qty=5, user=self.user)
+        response = self.post(reverse('battery:assignment_create'), other, 5)
+        self.assertRedirects(response, reverse('battery:assignment'))
+
+
+class AssignedQtyTests(BatteryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.battery_type, self.battery_model = create_inventory(self.user, 2)
+        self.device0, self.device1 = Device.objects.order_by('pk')
+
+    def assertAssignedQty(self, *expected):
+        self.assertEqual([device.assigned_qty for device in Device.objects.order_by('pk')], list(expected))
+        self.assertFalse(wrong_assigned_qty().exists())
+
+    def test_counter_follows_the_assignments(self):
+        self.assertAssignedQty(1, 1)
+        assignment = BatteryAssignment.objects.get(device=self.device0)
+        assignment.battery_qty = 2
+        assignment.save()
+        self.assertAssignedQty(2, 1)
+        assignment.device = self.device1
+        assignment.save()
+        self.assertAssignedQty(0, 3)
+        assignment.delete()
+        self.assertAssignedQty(0, 1)
+        self.battery_model.delete()   # cascade to the assignments
+        self.assertAssignedQty(0, 0)
+
+    def test_device_update_keeps_the_counter(self):
+        response = self.client.post(reverse('battery:device_detail', args=[self.device0.pk]),
+                                    {'description': 'Renamed', 'battery_type': self.battery_type.pk,
+                                     'battery_qty': 4})
+        self.assertRedirects(response, reverse('battery:device'))
+        self.assertAssignedQty(1, 1)
+
+    def test_rebuild_command(self):
+        Device.objects.update(assigned_qty=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_assigned_qty', '--check', stdout=StringIO())
+        call_command('rebuild_assigned_qty', stdout=StringIO())
+        self.assertAssignedQty(1, 1)
+
+    def test_cascade_query_count_does_not_depend_on_row_count(self):
+        # The rows deleted in cascade are deleted in bulk, not one by one
+        def delete_type(battery_type):
+            with CaptureQueriesContext(connection) as ctx:
+                battery_type.delete()
+            return len(ctx.captured_queries)
+
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        small, large = create_inventory(other, 1)[0], create_inventory(other, 20)[0]
+        self.assertEqual(delete_type(small), delete_type(large))
+        self.assertFalse(Device.objects.filter(user=other).exists())
+        self.assertFalse(SearchEntry.objects.filter(user=other).exclude(kind='model').exists())
+        self.assertAssignedQty(1, 1)
+
+
+class DetailFormTests(BatteryTestCase):
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_assignment_form_query_count_does_not_depend_on_devices(self):
+        create_inventory(self.user, 1)
+        few, response = self.count_queries(reverse('battery:assignment_create'))
+        create_inventory(self.user, 20)
+        many, response = self.count_queries(reverse('battery:assignment_create'))
+        self.assertEqual(many, few)
+        # The devices are searched as the user types instead of being rendered as options
+        self.assertNotContains(response, 'Device 19 (2x AA)')
+        self.assertContains(response, f'data-typeahead-url="{reverse("battery:api:device_search")}"')
+
+    def test_failed_post_keeps_the_selected_device(self):
+        battery_type, battery_model = create_inventory(self.user, 1)
+        device = Device.objects.get(user=self.user)
+        response = self.client.post(reverse('battery:assignment_create'),
+                                    {'device': device.pk, 'battery_model': battery_model.pk, 'battery_qty': 5})
+        self.assertContains(response, f'<option value="{device.pk}" selected>Device 0 (2x AA)</option>', html=True)
+
+
+class ApiTests(BatteryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.battery_type, self.battery_model = create_inventory(self.user, 1)  # 'Device 0' has 1 battery of 2
+
+    def send(self, method, name, data):
+        return getattr(self.client, method)(reverse(f'battery:api:{name}'), json.dumps(data),
+                                            content_type='application/json')
+
+    def test_authentication_required(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('battery:api:devices')).status_code, 401)
+
+    def test_bulk_create_and_list(self):
+        devices = [{'description': f'New {i}', 'battery_type': self.battery_type.pk, 'battery_qty': 3}
+                   for i in range(5)]
+        response = self.send('post', 'devices', devices)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 5)
+
+        response = self.client.get(reverse('battery:api:devices'), {'size': 4})
+        self.assertEqual(len(response.json()['results']), 4)
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([device['description'] for device in response.json()['results']], ['New 3', 'New 4'])
+        self.assertIsNone(response.json()['next'])
+
+    def test_bulk_create_is_validated_as_a_whole(self):
+        device = Device.objects.get(user=self.user)
+        assignments = [{'device': device.pk, 'battery_model': self.battery_model.pk, 'battery_qty': 1},
+                       {'device': device.pk, 'battery_model': self.battery_model.pk, 'battery_qty': 1}]
+        response = self.send('post', 'assignments', assignments)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'],
+                         {'1': {'battery_qty': ['No more than 0 battery can be assigned to this device.']}})
+        self.assertEqual(BatteryAssignment.objects.count(), 1)
+
+        response = self.send('post', 'assignments', assignments[:1])
+        self.assertEqual(response.status_code, 201)
+        device.refresh_from_db()
+        self.assertEqual(device.assigned_qty, 2)
+
+    def test_bulk_update_and_delete(self):
+        other = Device.objects.create(description='Other', battery_type=self.battery_type, battery_qty=3,
+                                      user=self.user)
+        assignment = BatteryAssignment.objects.get(user=self.user)
+        response = self.send('patch', 'assignments', [{'id': assignment.pk, 'device': other.pk, 'battery_qty': 3}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Device.objects.order_by('pk').values_list('assigned_qty', flat=True)), [0, 3])
+        # The updates are objects, not ids
+        self.assertEqual(self.send('patch', 'assignments', [assignment.pk]).status_code, 400)
+
+        response = self.send('delete', 'assignments', [assignment.pk])
+        self.assertEqual(response.json(), {'deleted': 1})
+        self.assertFalse(wrong_assigned_qty().exists())
+
+    def test_other_users_objects_are_not_visible(self):
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        battery_type, battery_model = create_inventory(other, 1)
+        response = self.send('post', 'devices', {'description': 'X', 'battery_type': battery_type.pk,
+                                                 'battery_qty': 1})
+        self.assertEqual(response.status_code, 400)
+        response = self.send('delete', 'devices', list(Device.objects.filter(user=other).values_list('pk', flat=True)))
+        self.assertEqual(response.json(), {'deleted': 0})
+
+
+class ExportTests(BatteryTestCase):
+
+    def test_export_honors_the_filters(self):
+        battery_type, battery_model = create_inventory(self.user, 2)
+        other_type = BatteryType.objects.create(type='C', user=self.user)
+        Device.objects.create(description='Lamp', battery_type=other_type, battery_qty=1, user=self.user)
+
+        response = self.client.get(reverse('battery:device_export'), {'battery_type': other_type.pk})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,description,battery_type,battery_qty,assigned_qty')
+        self.assertEqual(lines[1:], [f'{Device.objects.get(description="Lamp").pk},Lamp,C,1,0'])
+
+        response = self.client.get(reverse('battery:assignment_export'),
+                                   {'battery_type': battery_type.pk, 'battery_model': '0', 'format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['device'], row['battery_type'], row['battery_model'], row['battery_qty'])
+                          for row in rows],
+                         [('Device 0', 'AA', 'Rechargeable 1.2V', 1), ('Device 1', 'AA', 'Rechargeable 1.2V', 1)])
+
+
+class ImportTests(BatteryTestCase):
+    CSV = """device,battery_type,capacity,battery_model,battery_qty
+Remote,AAA,2,Alkaline,1
+Remote,,,Rechargeable,1
+Remote,,,Alkaline,1
+Clock,AA,1,,
+Lamp,,,,
+"""
+
+    def import_csv(self, *args):
+        path = self.tmp_dir / 'inventory.csv'
+        path.write_text(self.CSV, encoding='utf-8')
+        out, err = StringIO(), StringIO()
+        call_command('import_inventory', str(path), '--user', self.user.email, '--batch-size', '2', *args,
+                     stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = Path(tmp_dir.name)
+
+    def test_import(self):
+        out, err = self.import_csv()
+        # The 3rd assignment exceeds the capacity of the Remote, the Lamp is new but has no type
+        self.assertIn("Line 4: Remote: No more than 0 battery can be assigned", err)
+        self.assertIn("Line 6: battery_type is required", err)
+        self.assertIn("3 rows imported, 2 rows with errors", out)
+        self.assertEqual(dict(Device.objects.filter(user=self.user).values_list('description', 'assigned_qty')),
+                         {'Remote': 2, 'Clock': 0})
+        self.assertEqual(BatteryModel.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(wrong_assigned_qty().exists())
+
+    def test_numbers_which_int_rejects_are_reported(self):
+        self.CSV = "device,battery_type,capacity,battery_model,battery_qty\nRemote,AAA,²,,\nClock,AA,1,Alkaline,²\n"
+        out, err = self.import_csv()
+        self.assertIn("Line 2: capacity must be a number", err)
+        self.assertIn("Line 3: battery_qty must be a number", err)
+        self.assertIn("0 rows imported, 2 rows with errors", out)
+
+    def test_encoding_and_unreadable_files(self):
+        self.CSV = "device,battery_type,capacity,battery_model,battery_qty\nRadio à piles,AA,2,,\n"
+        (self.tmp_dir / 'inventory.csv').write_bytes(self.CSV.encode('latin-1'))
+        path = str(self.tmp_dir / 'inventory.csv')
+        with self.assertRaisesMessage(CommandError, 'as utf-8-sig'):
+            call_command('import_inventory', path, '--user', self.user.email, stdout=StringIO())
+        call_command('import_inventory', path, '--user', self.user.email, '--encoding', 'latin-1', stdout=StringIO())
+        self.assertTrue(Device.objects.filter(description='Radio à piles').exists())
+        with self.assertRaisesMessage(CommandError, 'Cannot read'):
+            call_command('import_inventory', str(self.tmp_dir / 'missing.csv'), '--user', self.user.email)
+
+    def test_dry_run(self):
+        out, err = self.import_csv('--dry-run')
+        self.assertIn("3 rows imported", out)
+        self.assertFalse(Device.objects.exists())
+        self.assertFalse(BatteryType.objects.exists())
+
+
+class SeedTests(TestCase):
+
+    def test_signup_seeds_the_new_user(self):
+        self.client.post('/accounts/signup/', {'email': 'new@example.com', 'password1': 'a-Long-passw0rd'})
+        user = CustomUser.objects.get(email='new@example.com')
+        self.assertEqual(sorted(BatteryType.objects.filter(user=user).values_list('type', flat=True)), ['AA', 'AAA'])
+        self.assertEqual(BatteryModel.objects.filter(user=user).count(), 3)
+
+    def test_backfill_command(self):
+        user = CustomUser.objects.create_user(username='old', email='old@example.com', password='secret')
+        BatteryType.objects.create(type='AA', user=user)
+        call_command('seed_users', stdout=StringIO())
+        call_command('seed_users', stdout=StringIO())   # seeding twice does not create duplicates
+        self.assertEqual(sorted(BatteryType.objects.filter(user=user).values_list('type', flat=True)), ['AA', 'AAA'])
+        self.assertEqual(BatteryModel.objects.filter(user=user).count(), 3)
+
+
+class BenchmarkTests(TestCase):
+
+    def test_seed_and_benchmark(self):
+        call_command('seed_benchmark', '--users', '2', '--devices', '20', '--assignments', '30', stdout=StringIO())
+        self.assertEqual(Device.objects.filter(user__email='bench1@example.invalid').count(), 20)
+        self.assertFalse(wrong_assigned_qty().exists())
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            baseline = Path(tmp_dir) / 'baseline.json'
+            call_command('benchmark', '--repeat', '2', '--warmup', '0', '--save', str(baseline), stdout=StringIO())
+            results = json.loads(baseline.read_text())['results']
+            self.assertEqual(results['assignment index']['status'], 200)
+            self.assertEqual(results['assignment create (POST)']['status'], 302)
+            # The POST requests are rolled back
+            self.assertEqual(BatteryAssignment.objects.filter(user__email='bench0@example.invalid').count(), 30)
+
+            # A new query on an endpoint is a regression
+            results['device index']['queries'] -= 1
+            baseline.write_text(json.dumps({'results': results}))
+            with self.assertRaisesMessage(CommandError, 'device index'):
+                call_command('benchmark', '--repeat', '2', '--warmup', '0', '--compare', str(baseline),
+                             '--tolerance', '1000', stdout=StringIO())
+
+    def test_seed_needs_types_and_models(self):
+        for args, message in ((('--types', '0'), '--types'), (('--models', '0'), '--models'),
+                              (('--devices', '-1'), '--devices')):
+            with self.assertRaisesMessage(CommandError, message):
+                call_command('seed_benchmark', '--users', '1', *args, stdout=StringIO())
+        self.assertFalse(CustomUser.objects.filter(email__endswith='@example.invalid').exists())
+        # Without devices, no battery type is needed
+        call_command('seed_benchmark', '--users', '1', '--types', '0', '--devices', '0', '--assignments', '0',
+                     stdout=StringIO())
+        self.assertTrue(CustomUser.objects.filter(email='bench0@example.invalid').exists())
+
+
+class SQLiteConcurrentTests(SimpleTestCase):
+    # The concurrent mode of SQLite (config/sqlite_backend), on its own database file
+
+    def test_pragmas_and_immediate_transaction(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = str(Path(tmp_dir) / 'db.sqlite3')
+            backend = load_backend('config.sqlite_backend')
+            wrapper = backend.DatabaseWrapper({**connection.settings_dict, 'NAME': path,
+                                               'PRAGMAS': {'busy_timeout': 100}})
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 100)
+                    cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+
+                # The write lock is taken when the transaction starts, before any write
+                wrapper._start_transaction_under_autocommit()
+                other = sqlite3.connect(path, timeout=0)
+                with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+                    other.execute('INSERT INTO item VALUES (1)')
+                # ... but the database can still be read
+                self.assertEqual(other.execute('SELECT COUNT(*) FROM item').fetchone()[0], 0)
+                other.close()
+                wrapper.connection.rollback()
+            finally:
+                wrapper.close()
+
+
+class InstrumentationTests(BatteryTestCase):
+
+    @override_settings(BATTERY_INSTRUMENTATION={'SAMPLE_RATE': 1, 'QUERY_THRESHOLD': 100})
+    def test_sampled_request(self):
+        create_inventory(self.user, 2)
+        with self.assertLogs('battery.instrumentation', 'INFO') as logs:
+            response = self.client.get(reverse('battery:assignment'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'battery:assignment')
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+
+    @override_settings(BATTERY_INSTRUMENTATION={'SAMPLE_RATE': 1, 'QUERY_THRESHOLD': 1})
+    def test_query_threshold(self):
+        with self.assertLogs('battery.instrumentation', 'WARNING') as logs:
+            self.client.get(reverse('battery:device'))
+        self.assertTrue(json.loads(logs.records[0].getMessage())['too_many_queries'])
+
+    @override_settings(BATTERY_INSTRUMENTATION={'SAMPLE_RATE': 0})
+    def test_not_sampled(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('battery:device')))
+
+
+class AdminTests(TestCase):
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com',
+                                                         password='secret')
+        self.client.force_login(self.admin)
+
+    def test_changelist_query_count_does_not_depend_on_rows(self):
+        url = reverse('admin:battery_batteryassignment_changelist')
+        create_inventory(self.admin, 2)
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        BatteryType.objects.all().delete()
+        create_inventory(self.admin, 20)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        self.assertEqual(len(many), len(few))
+
+    def test_set_battery_qty_action(self):
+        create_inventory(self.admin, 2)
+        BatteryAssignment.objects.update(battery_qty=2)
+        Device.objects.update(assigned_qty=2)
+        self.client.post(reverse('admin:battery_batteryassignment_changelist'),
+                         {'action': 'set_battery_qty_to_one',
+                          '_selected_action': list(BatteryAssignment.objects.values_list('pk', flat=True))})
+        self.assertEqual(set(Device.objects.values_list('assigned_qty', flat=True)), {1})
+        self.assertFalse(wrong_assigned_qty().exists())
+
+
+class TypeaheadSearchTests(BatteryTestCase):
+
+    @override_settings(BATTERY_TYPEAHEAD_SIZE=3)
+    def test_search(self):
+        battery_type, battery_model = create_inventory(self.user, 2)
+        for description in ('Remote', 'Clock', 'Smoke detector', 'Garage remote'):
+            Device.objects.create(description=description, battery_type=battery_type, battery_qty=1, user=self.user)
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        create_inventory(other, 1)
+
+        def search(url, text):
+            return [result['label'] for result in self.client.get(url, {'q': text}).json()['results']]
+
+        url = reverse('battery:api:device_search')
+        # The prefix matches first, then the substring matches
+        self.assertEqual(search(url, 'Remote'), ['Remote (1x AA)', 'Garage remote (1x AA)'])
+        self.assertEqual(search(url, 'c'), ['Clock (1x AA)', 'Device 0 (2x AA)', 'Device 1 (2x AA)'])
+        self.assertEqual(search(url, 'Device'), ['Device 0 (2x AA)', 'Device 1 (2x AA)'])
+        self.assertEqual(search(reverse('battery:api:model_search'), 'charge'), ['Rechargeable 1.2V'])
+
+        self.client.logout()
+        self.assertEqual(self.client.get(url, {'q': 'Remote'}).status_code, 401)
+
+
+class SummaryTests(BatteryTestCase):
+
+    def test_summary(self):
+        battery_type, battery_model = create_inventory(self.user, 3)
+        other_model = BatteryModel.objects.create(description='Alkaline', user=self.user)
+        BatteryAssignment.objects.create(device=Device.objects.get(description='Device 0'), battery_model=other_model,
+                                         battery_qty=1, user=self.user)
+        with self.assertNumQueries(4):   # the session, the user, then one query per table
+            summary = self.client.get(reverse('battery:api:summary')).json()
+        self.assertEqual(summary['assignments'], [
+            {'type': 'AA', 'model': 'Alkaline', 'assignment_count': 1, 'device_count': 1, 'battery_total': 1},
+            {'type': 'AA', 'model': 'Rechargeable 1.2V', 'assignment_count': 3, 'device_count': 3,
+             'battery_total': 3}])
+        self.assertEqual(summary['devices'], [
+            {'battery_type': battery_type.pk, 'type': 'AA', 'device_count': 3, 'capacity': 6, 'assigned': 4,
+             'free_device_count': 2, 'free': 2}])
+
+    def test_summary_query_count_does_not_depend_on_row_count(self):
+        battery_type, battery_model = create_inventory(self.user, 3)
+        with self.assertNumQueries(2):  # one GROUP BY on the assignments, one on the devices
+            inventory_summary(self.user)
+        Device.objects.bulk_create(Device(description=f'More {i}', battery_type=battery_type, battery_qty=2,
+                                          user=self.user) for i in range(30))
+        with self.assertNumQueries(2):
+            summary = inventory_summary(self.user)
+        self.assertEqual(summary['devices'][0]['device_count'], 33)
+
+    def test_summary_free_matches_the_devices(self):
+        # An over-assigned device has no free battery, like Device.free_qty: it does not hide those of other devices
+        create_inventory(self.user, 2)
+        Device.objects.filter(description='Device 0').update(assigned_qty=5)
+        summary = self.client.get(reverse('battery:api:summary')).json()
+        self.assertEqual(summary['devices'][0]['free'], sum(device.free_qty for device in Device.objects.all()))
+        self.assertEqual(summary['devices'][0]['free'], 1)
+
+    def test_summary_is_cached_until_the_inventory_changes(self):
+        create_inventory(self.user, 1)
+        self.client.get(reverse('battery:summary'))
+        self.assertContains(self.client.get(reverse('battery:summary')), 'Rechargeable 1.2V')
+        with CaptureQueriesContext(connection) as warm:
+            self.client.get(reverse('battery:api:summary'))
+        Device.objects.update(battery_qty=5)    # no signal: the cache is not evicted
+        self.assertEqual(self.client.get(reverse('battery:api:summary')).json()['devices'][0]['capacity'], 2)
+
+        BatteryAssignment.objects.first().delete()
+        with CaptureQueriesContext(connection) as cold:
+            summary = self.client.get(reverse('battery:api:summary')).json()
+        self.assertEqual(summary['assignments'], [])
+        self.assertEqual(len(cold) - len(warm), 2)
+
+
+class TableCacheTests(BatteryTestCase):
+
+    def get(self, name, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(name), params or {})
+        return response, len(ctx.captured_queries)
+
+    def test_tables_are_cached_until_the_inventory_changes(self):
+        create_inventory(self.user, 2)
+        for name in ('battery:assignment', 'battery:device', 'battery:model', 'battery:type'):
+            self.get(name)
+            response, warm = self.get(name)
+            self.assertEqual(warm, 3, name)     # the session, its user and the ETag (see ConditionalGetTests)
+            self.assertIn('Total' if name in ('battery:assignment', 'battery:device') else '1 battery',
+                          response.content.decode())
+
+        device = Device.objects.get(description='Device 1')
+        device.description = 'Flashlight'
+        device.save()
+        self.assertContains(self.get('battery:device')[0], 'Flashlight')
+        self.assertContains(self.get('battery:assignment')[0], 'Flashlight')
+
+    def test_csrf_token_is_not_part_of_the_key(self):
+        battery_type, battery_model = create_inventory(self.user, 1)
+        params = {'battery_type': battery_type.pk, 'battery_model': 0}
+        self.get('battery:assignment', {**params, 'csrfmiddlewaretoken': 'a'})
+        response, queries = self.get('battery:assignment', {**params, 'csrfmiddlewaretoken': 'b'})
+        self.assertEqual(queries, 3)
+        self.assertContains(response, 'Device 0')
+
+
+class ConditionalGetTests(BatteryTestCase):
+
+    def test_unchanged_pages_are_not_rendered(self):
+        battery_type, battery_model = create_inventory(self.user, 2)
+        assignment = BatteryAssignment.objects.first()
+        for url in (reverse('battery:assignment'), reverse('battery:device'), reverse('battery:model'),
+                    reverse('battery:type'), reverse('battery:assignment_detail', args=[assignment.pk]),
+                    reverse('battery:device_detail', args=[assignment.device_id])):
+            self.client.get(url)    # the first response sets the CSRF cookie, which is part of the ETag
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(3):  # the session, its user and the ETag
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_changes_and_deletions_change_the_etag(self):
+        create_inventory(self.user, 2)
+        url = reverse('battery:device')
+        etag = self.client.get(url)['ETag']
+
+        BatteryAssignment.objects.first().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        BatteryType.objects.update(description='Alkaline')  # not through save(): updated_at is not changed
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        battery_type = BatteryType.objects.first()
+        battery_type.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_is_per_user(self):
+        create_inventory(self.user, 1)
+        etag = self.client.get(reverse('battery:type'))['ETag']
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('battery:type'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+def routed_read(method, cookies=None, action=None):
+    # Send a request with the cookies through PrimaryPinningMiddleware. Return the DB which serves the reads of the
+    # battery tables in the view, after action(request) if any, and the cookies of the response
+    def view(request):
+        if action:
+            action(request)
+        return HttpResponse(ReplicaRouter().db_for_read(Device))
+
+    request = getattr(RequestFactory(), method)('/')
+    request.COOKIES.update(cookies or {})
+    response = PrimaryPinningMiddleware(view)(request)
+    return response.content.decode(), response.cookies
+
+
+def write(request):
+    ReplicaRouter().db_for_write(Device)
+
+
+@mock.patch('battery.routers.replica', return_value='replica')
+class ReplicaRouterTests(SimpleTestCase):
+    # The routing is tested without a replica DB: there is no DB access outside a TestCase
+
+    def test_get_requests_read_from_the_replica(self, replica):
+        self.assertEqual(routed_read('get')[0], 'replica')
+        self.assertEqual(routed_read('post')[0], 'default')
+        # The other apps, and the battery tables outside a request, are read from the primary
+        self.assertIsNone(ReplicaRouter().db_for_read(CustomUser))
+        self.assertEqual(ReplicaRouter().db_for_read(Device), 'default')
+        self.assertFalse(ReplicaRouter().allow_migrate('replica', 'battery'))
+
+    def test_client_sticks_to_the_primary_after_a_write(self, replica):
+        db, cookies = routed_read('get', action=write)
+        self.assertEqual(db, 'default')
+        self.assertEqual(routed_read('get', {STICKY_COOKIE: cookies[STICKY_COOKIE].value})[0], 'default')
+        # Expired, or not signed
+        expired = get_cookie_signer(salt=STICKY_COOKIE * 2).sign('0')
+        self.assertEqual(routed_read('get', {STICKY_COOKIE: expired})[0], 'replica')
+        self.assertEqual(routed_read('get', {STICKY_COOKIE: '9999999999'})[0], 'replica')
+
+    def test_cold_caches_are_filled_from_the_primary(self, replica):
+        cache.clear()
+
+        def render_table(request):
+            request.user = mock.Mock(pk=1)
+            arguments = table_cache(request, 'type')
+            return [make_template_fragment_key(f'battery_type_{fragment}', [1, '', arguments['version']])
+                    for fragment in ('headline', 'table')]
+
+        self.assertEqual(routed_read('get', action=render_table)[0], 'default')
+        cache.set_many({key: 'fragment' for key in render_table(RequestFactory().get('/'))})
+        self.assertEqual(routed_read('get', action=render_table)[0], 'replica')
+
+
+@mock.patch('battery.routers.replica', return_value='replica')
+class ReplicaTransactionTests(BatteryTestCase):
+
+    def test_transactions_read_from_the_primary(self, replica):
+        # The test runs in a transaction: the pages are served from the primary, 'replica' is not a configured DB
+        self.assertEqual(routed_read('get')[0], 'default')
+        create_inventory(self.user, 1)
+        self.assertEqual(self.client.get(reverse('battery:device')).status_code, 200)
+
+
+class SearchTests(BatteryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.battery_type, self.battery_model = create_inventory(self.user, 2)
+        self.device = Device.objects.get(description='Device 0')
+        self.assignment = BatteryAssignment.objects.get(device=self.device)
+
+    def found(self, text):
+        return set(search(self.user, text, 50))
+
+    def test_last_word_is_matched_by_prefix(self):
+        self.assertEqual(self.found('recharg'), {('model', self.battery_model.pk)} |
+                         {('assignment', pk) for pk in BatteryAssignment.objects.values_list('pk', flat=True)})
+        self.assertEqual(self.found('device 0'), {('device', self.device.pk), ('assignment', self.assignment.pk)})
+        self.assertEqual(self.found('aa'), {('type', self.battery_type.pk)})
+        # Only the last word is matched as a prefix
+        self.assertEqual(self.found('dev 0'), set())
+        # The FTS5 syntax of the text is ignored
+        self.assertEqual(self.found('"dev* OR'), set())
+        self.assertEqual(self.found('-*'), set())
+
+    def test_entries_follow_the_changes(self):
+        self.device.description = 'Flashlight'
+        self.device.save()
+        self.assertEqual(self.found('flash'), {('device', self.device.pk), ('assignment', self.assignment.pk)})
+        self.device.delete()
+        self.assertEqual(self.found('flash'), set())
+        self.assertFalse(SearchEntry.objects.filter(kind='assignment', object_id=self.assignment.pk).exists())
+
+    def test_other_users_are_not_found(self):
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        create_inventory(other, 1)
+        self.assertEqual(len(self.found('device')), 4)
+        response = self.client.get(reverse('battery:search'), {'q': 'device 1'})
+        self.assertContains(response, reverse('battery:device_detail', args=[Device.objects.get(
+            user=self.user, description='Device 1').pk]))
+        self.assertNotContains(response, reverse('battery:device_detail', args=[Device.objects.get(user=other).pk]))
+
+    def test_bulk_writes_and_rebuild(self):
+        response = self.client.post(reverse('battery:api:devices'), json.dumps(
+            [{'description': 'Smoke detector', 'battery_type': self.battery_type.pk, 'battery_qty': 1}]),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.found('smoke')), 1)
+
+        SearchEntry.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('7 search entries of 1 users', out.getvalue())
+        self.assertEqual(len(self.found('smoke')), 1)
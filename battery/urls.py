@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import include, path
 
 from battery import views
 
@@ -18,6 +18,8 @@ urlpatterns = [
     path('assignment/create', views.assignment_detail, name='assignment_create'),
     path('assignment/<int:pk>', views.assignment_detail, {'create': False}, name='assignment_detail'),
     path('assignment/<int:pk>/delete', views.assignment_delete, name='assignment_delete'),
+    # Export of the (filtered) assignments as CSV or NDJSON
+    path('assignment/export', views.assignment_export, name='assignment_export'),
     #
     # CRUD for battery models
     path('model', views.model, name='model'),
@@ -36,6 +38,20 @@ urlpatterns = [
     path('device/create', views.device_detail, name='device_create'),
     path('device/<int:pk>', views.device_detail, {'create': False}, name='device_detail'),
     path('device/<int:pk>/delete', views.device_delete, name='device_delete'),
+    # Export of the (filtered) devices as CSV or NDJSON
+    path('device/export', views.device_export, name='device_export'),
+
+    #
+    # Overview of the inventory
+    path('summary', views.summary, name='summary'),
+
+    #
+    # Full-text search of the inventory
+    path('search', views.search, name='search'),
+
+    #
+    # JSON API with bulk create/update/delete (see battery/api)
+    path('api/', include('battery.api.urls')),
 
     # For test debug
     # path('test', views.test, name='test'),
@@ -1,5 +1,8 @@
 from battery.views.assignment import *
 from battery.views.device import *
+from battery.views.export import *
 from battery.views.model import *
+from battery.views.search import *
 from battery.views.signup import *
+from battery.views.summary import *
 from battery.views.type import *
@@ -1,7 +1,12 @@
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
+from django.utils.functional import SimpleLazyObject
 
+from battery.cache import table_cache
+from battery.conditional import inventory_condition
 from battery.forms import *
+from battery.pagination import paginate
 
 APPNAME = "battery/"
 
@@ -9,11 +14,11 @@ APPNAME = "battery/"
 # battery assignments
 #
 
-@login_required
-def assignment(request):
-    # Only a GET request is valid
-    # But there is no need to check the method used for this request since the template is protected with CSRF
-    # and if a non-GET is received, django replies with "403 Forbidden" because of lack of valid CSRF in request
+def filter_assignments(request, assignments):
+    # Apply the filter of the GET parameters of the request (BatteryAssignmentFormFilter) to the assignments of
+    # the user ('assignments' is a BatteryAssignment.objects.for_user() QuerySet)
+    # Return the filter form and the QuerySet of the filtered assignments
+    # Used by the assignment index and the export of the assignments
 
     # if the GET request contains a parameter then a bound form must be created
     if request.GET.get('battery_type'):
@@ -26,14 +31,14 @@ def assignment(request):
 
             # Generate the filter as a dict which is subsequently passed expanded (with '**') to the .filter() method
 
-            if battery_type_filter == '0' and battery_model_filter == '0':  # filter only on user
-                assignment_filter = {"user": request.user}
-            elif battery_type_filter == '0':  # filter on user & battery_model
-                assignment_filter = {"user": request.user, "battery_model": battery_model_filter}
-            elif battery_model_filter == '0':  # filter on user & battery_type
-                assignment_filter = {"user": request.user, "device__battery_type": battery_type_filter}
-            else:  # filter on user, battery_model and battery_type (need to follow the 'device' key)
-                assignment_filter = {"user": request.user, "battery_model": battery_model_filter,
+            if battery_type_filter == '0' and battery_model_filter == '0':  # no filter
+                assignment_filter = {}
+            elif battery_type_filter == '0':  # filter on battery_model
+                assignment_filter = {"battery_model": battery_model_filter}
+            elif battery_model_filter == '0':  # filter on battery_type
+                assignment_filter = {"device__battery_type": battery_type_filter}
+            else:  # filter on battery_model and battery_type (need to follow the 'device' key)
+                assignment_filter = {"battery_model": battery_model_filter,
                                      "device__battery_type": battery_type_filter}
 
             # battery_type is not a property of the BatteryAssignment model.
@@ -41,7 +46,7 @@ def assignment(request):
             # So I need to follow the 'device' key (SQL JOIN)
             # Since this is a QuerySet based on BatteryAssignment model I need to access the Device model fields
             # with the syntax: device__battery_type
-            assignments = BatteryAssignment.objects.select_related('device').filter(**assignment_filter)
+            assignments = assignments.filter(**assignment_filter)
 
         else:
             pass  # Form is not valid (i.e., it did not pass the validation checks)
@@ -52,12 +57,30 @@ def assignment(request):
     # GET request without filter parameters = show all battery assignments for this user
     else:
         form = BatteryAssignmentFormFilter(user=request.user)
-        assignments = BatteryAssignment.objects.filter(user=request.user)
 
-    # Calculate total nb of battery used for the assignments and render the page
-    qsum = assignments.aggregate(Sum('battery_qty'))  # return a dict like this: {'battery_qty__sum': 26}
+    return form, assignments
+
+
+@login_required
+@inventory_condition
+def assignment(request):
+    # Only a GET request is valid
+    # But there is no need to check the method used for this request since the template is protected with CSRF
+    # and if a non-GET is received, django replies with "403 Forbidden" because of lack of valid CSRF in request
+
+    # Every row rendered in the template shows assignment.device (Device.__str__ uses device.battery_type)
+    # and assignment.battery_model: for_user() follows all these keys in a single SQL JOIN, otherwise each row of
+    # the table triggers extra queries. for_list() only reads the columns rendered
+    form, assignments = filter_assignments(request, BatteryAssignment.objects.for_user(request.user).for_list())
+
+    # Only one page of assignments is rendered, but the headline and the total cover all the filtered assignments
+    # Calculate nb of assignments and total nb of battery used for the assignments (one query) and render the page
+    # The page and the totals are only queried when the template renders them: the headline and the table are
+    # cached until the inventory of the user changes (see table_cache())
+    totals = SimpleLazyObject(assignments.totals)
     return render(request, APPNAME + 'assignment_index.html',
-                  {'form': form, 'assignments': assignments, 'battery_total': qsum['battery_qty__sum']})
+                  {'form': form, 'page': paginate(request, assignments), 'totals': totals,
+                   'table_cache': table_cache(request, 'assignment')})
 
 
 '''
@@ -68,36 +91,34 @@ detail of a battery assignment
 
 
 @login_required
+@inventory_condition
 def assignment_detail(request, pk=None, create=True):
     # POST request = submission of a form which must be saved to DB
     if request.method == 'POST':
-        form = BatteryAssignmentForm(data=request.POST, user=request.user)
-
-        # For form validation, need to know the battery_qty of the assignment in the DB which will be updated
-        if create:  # Create an assignment, use an initial battery_qty of 0 for validation
-            form.initial['battery_qty'] = 0  # Add this info to the form for validation
-        else:  # Update an assignment, retrieve the initial battery_qty of the assignment being updated
-            # Need to check the battery_qty of the assignment being updated
-            instance = get_object_or_404(BatteryAssignment, pk=pk, user=request.user)  # retrieve the BA being updated
-            form.initial['battery_qty'] = instance.battery_qty  # Add this info to the form for validation
-
-        # Check if the form submitted by user (bound form) passes all the validation checks
-        if form.is_valid():
-            # Here no action needed on the form, no need to extract the parameters from the 'cleaned_data' dict
-            instance = form.save(commit=False)  # returns the BatteryAssignment instance stored in form.instance
-            instance.user = request.user  # Add user to the BatteryAssignment
-
-            if not create:  # Update an BatteryAssignment
-                instance.pk = pk  # primary key of the BatteryAssignment to update
-
-            instance.save()  # save the BatteryAssignment to the DB
-            return redirect('battery:assignment')
-
-        else:
-            pass  # Form is not valid (i.e., it did not pass the validation checks)
-            # is_valid() method created errors dict, so form reference now contains errors
-            # this form reference drops to the last return statement where errors
-            # can then be presented accessing form.errors in a template
+        # The validation of the battery capacity of the device and the save are done in the same transaction:
+        # the Device is locked by clean_battery_qty() so that concurrent submissions cannot over-assign it
+        with transaction.atomic():
+            # For form validation, the assignment being updated must not be counted in the batteries already
+            # assigned to the device: pass it to the form
+            if create:  # Create an assignment
+                instance = None
+            else:  # Update an assignment, retrieve the assignment being updated
+                instance = get_object_or_404(BatteryAssignment.objects.for_user(request.user), pk=pk)
+            form = BatteryAssignmentForm(data=request.POST, user=request.user, instance=instance)
+
+            # Check if the form submitted by user (bound form) passes all the validation checks
+            if form.is_valid():
+                # Here no action needed on the form, no need to extract the parameters from the 'cleaned_data' dict
+                instance = form.save(commit=False)  # returns the BatteryAssignment instance stored in form.instance
+                instance.user = request.user  # Add user to the BatteryAssignment
+                instance.save()  # save the BatteryAssignment to the DB
+                return redirect('battery:assignment')
+
+            else:
+                pass  # Form is not valid (i.e., it did not pass the validation checks)
+                # is_valid() method created errors dict, so form reference now contains errors
+                # this form reference drops to the last return statement where errors
+                # can then be presented accessing form.errors in a template
 
     # GET request is either:
     # - for creating a new assignment => create=True
@@ -113,7 +134,7 @@ def assignment_detail(request, pk=None, create=True):
             # assign = BatteryAssignment.objects.filter(user=request.user).get(pk=pk)
             # form = BatteryAssignmentForm(initial=model_to_dict(assign))  # populate the form based on the QuerySet
             # Method 2
-            instance = get_object_or_404(BatteryAssignment, pk=pk, user=request.user)  # return a BA instance
+            instance = get_object_or_404(BatteryAssignment.objects.for_user(request.user), pk=pk)  # return a BA instance
             form = BatteryAssignmentForm(user=request.user, instance=instance)  # create form with User and BA instances
 
     # Hit if if method is GET
@@ -125,7 +146,7 @@ def assignment_detail(request, pk=None, create=True):
 def assignment_delete(request, pk):
     # POST request = delete assignment
     if request.method == 'POST':
-        assign = get_object_or_404(BatteryAssignment, pk=pk, user=request.user)  # returns BA instance
+        assign = get_object_or_404(BatteryAssignment.objects.for_user(request.user), pk=pk)  # returns BA instance
         assign.delete()
         return redirect('battery:assignment')
     else:
@@ -1,7 +1,11 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
+from django.utils.functional import SimpleLazyObject
 
+from battery.cache import table_cache
+from battery.conditional import inventory_condition
 from battery.forms import *
+from battery.pagination import paginate
 
 APPNAME = "battery/"
 
@@ -9,11 +13,11 @@ APPNAME = "battery/"
 # Devices
 #
 
-@login_required
-def device(request):
-    # Only a GET request is valid
-    # But there is no need to check the method used for this request since the template is protected with CSRF
-    # and if a non-GET is received, django replies with "403 Forbidden" because of lack of valid CSRF in request
+def filter_devices(request, devices):
+    # Apply the filter of the GET parameters of the request (DeviceFormFilter) to the devices of the user
+    # ('devices' is a Device.objects.for_user() QuerySet)
+    # Return the filter form and the QuerySet of the filtered devices
+    # Used by the device index and the export of the devices
 
     # if the GET request contains a parameter then a bound form must be created
     if request.GET.get('battery_type'):
@@ -21,10 +25,8 @@ def device(request):
         # Check if the bound form submitted by user passes all the validation checks
         if form.is_valid():
             # extract the parameters from the cleaned_data dict
-            if form.cleaned_data['battery_type'] == '0':  # filter only on user
-                devices = Device.objects.filter(user=request.user)
-            else:  # filter on user and battery_type
-                devices = Device.objects.filter(user=request.user, battery_type=form.cleaned_data['battery_type'])
+            if form.cleaned_data['battery_type'] != '0':  # filter on battery_type
+                devices = devices.filter(battery_type=form.cleaned_data['battery_type'])
         else:
             pass  # Form is not valid (i.e., it did not pass the validation checks)
             # is_valid() method created errors dict, so 'form' now contains errors
@@ -34,15 +36,30 @@ def device(request):
     # GET request without filter parameters = show all devices of the user
     else:
         form = DeviceFormFilter(user=request.user)
-        devices = Device.objects.filter(user=request.user)
 
-    # Calculate total nb of battery used by all devices and render the page
-    qsum = devices.aggregate(Sum('battery_qty'))  # return a dict like this: {'battery_qty__sum': 26}
+    return form, devices
+
+
+@login_required
+@inventory_condition
+def device(request):
+    # Only a GET request is valid
+    # But there is no need to check the method used for this request since the template is protected with CSRF
+    # and if a non-GET is received, django replies with "403 Forbidden" because of lack of valid CSRF in request
+    # Each row rendered in the template shows device.battery_type: for_user() follows it in the same query
+    form, devices = filter_devices(request, Device.objects.for_user(request.user).for_list())
+
+    # Only one page of devices is rendered, but the headline and the total cover all the filtered devices
+    # Calculate nb of devices and total nb of battery used by all devices (one query) and render the page
+    # The page and the totals are only queried when the template renders them (see assignment())
+    totals = SimpleLazyObject(devices.totals)
     return render(request, APPNAME + 'device_index.html',
-                  {'form': form, 'devices': devices, 'battery_total': qsum['battery_qty__sum']})
+                  {'form': form, 'page': paginate(request, devices), 'totals': totals,
+                   'table_cache': table_cache(request, 'device')})
 
 
 @login_required
+@inventory_condition
 def device_detail(request, pk=None, create=True):
     # POST request = submission of a form which must be saved to DB
     if request.method == 'POST':
@@ -53,10 +70,13 @@ def device_detail(request, pk=None, create=True):
             instance = form.save(commit=False)  # returns the Device instance stored in form.instance
             instance.user = request.user  # Add user to Device
 
-            if not create:  # Update an existing battery device
+            if create:
+                instance.save()  # save the Device to the DB
+            else:  # Update an existing battery device
+                get_object_or_404(Device.objects.for_user(request.user), pk=pk)  # the Device must belong to the user
                 instance.pk = pk  # primary key of the Device to update
-
-            instance.save()  # save the Device to the DB
+                # Only save the fields of the form: Device.assigned_qty is maintained by the battery assignments
+                instance.save(update_fields=DeviceForm.Meta.fields + ['updated_at'])
 
             return redirect('battery:device')
 
@@ -79,7 +99,7 @@ def device_detail(request, pk=None, create=True):
             # res = Device.objects.filter(user=request.user).get(pk=pk)
             # form = DeviceForm(initial=model_to_dict(res))  # populate the form based on the QuerySet
             # Method 2
-            instance = get_object_or_404(Device, pk=pk, user=request.user)  # returns Device instance
+            instance = get_object_or_404(Device.objects.for_user(request.user), pk=pk)  # returns Device instance
             form = DeviceForm(user=request.user, instance=instance)  # add Device instance to a form
 
     # Hit if if method is GET
@@ -91,6 +111,6 @@ def device_detail(request, pk=None, create=True):
 def device_delete(request, pk):
     # POST request = delete assignment
     if request.method == 'POST':
-        dev = get_object_or_404(Device, pk=pk, user=request.user)
+        dev = get_object_or_404(Device.objects.for_user(request.user), pk=pk)
         dev.delete()
         return redirect('battery:device')
@@ -0,0 +1,75 @@
+import csv
+import json
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import StreamingHttpResponse
+
+from battery.models import Device, BatteryAssignment
+from battery.views.assignment import filter_assignments
+from battery.views.device import filter_devices
+
+#
+# Export of the inventory
+#
+# The rows are streamed to the client while they are read from the DB with QuerySet.iterator(), by chunks of
+# BATTERY_EXPORT_CHUNK_SIZE rows, so that the memory used does not depend on the nb of rows exported.
+# The rows are read with values_list() and the foreign keys are followed in the same query (SQL JOIN).
+# The filters of the index pages (GET parameters) are applied to the export.
+#
+# Formats (GET parameter 'format'):
+# - csv (default)
+# - ndjson: one JSON object per line
+#
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Echo:
+    # An object implementing just the write method of the file-like interface: csv.writer writes to it and
+    # returns the line written, which is then streamed
+    # https://docs.djangoproject.com/en/dev/howto/outputting-csv/#streaming-large-csv-files
+    def write(self, value):
+        return value
+
+
+def _lines(header, rows, format_):
+    # Generate the lines of the export: the header (csv only) then one line per row
+    if format_ == 'ndjson':
+        for row in rows:
+            yield json.dumps(dict(zip(header, row))) + '\n'
+    else:
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+
+def _export(request, name, header, rows):
+    format_ = request.GET.get('format', 'csv')
+    if format_ not in EXPORT_FORMATS:
+        format_ = 'csv'
+    response = StreamingHttpResponse(_lines(header, rows, format_), content_type=EXPORT_FORMATS[format_])
+    response['Content-Disposition'] = f'attachment; filename="{name}.{format_}"'
+    return response
+
+
+@login_required
+def assignment_export(request):
+    form, assignments = filter_assignments(request, BatteryAssignment.objects.for_user(request.user))
+    header = ['id', 'device', 'battery_type', 'battery_model', 'battery_qty']
+    rows = assignments.order_by('pk').values_list(
+        'pk', 'device__description', 'device__battery_type__type', 'battery_model__description', 'battery_qty')
+    return _export(request, 'assignments', header, rows.iterator(chunk_size=settings.BATTERY_EXPORT_CHUNK_SIZE))
+
+
+@login_required
+def device_export(request):
+    form, devices = filter_devices(request, Device.objects.for_user(request.user))
+    header = ['id', 'description', 'battery_type', 'battery_qty', 'assigned_qty']
+    rows = devices.order_by('pk').values_list('pk', 'description', 'battery_type__type', 'battery_qty',
+                                              'assigned_qty')
+    return _export(request, 'devices', header, rows.iterator(chunk_size=settings.BATTERY_EXPORT_CHUNK_SIZE))
@@ -1,7 +1,11 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
+from django.utils.functional import SimpleLazyObject
 
+from battery.cache import table_cache
+from battery.conditional import inventory_condition
 from battery.forms import *
+from battery.pagination import paginate
 
 APPNAME = "battery/"
 
@@ -10,12 +14,17 @@ APPNAME = "battery/"
 #
 
 @login_required
+@inventory_condition
 def model(request):
-    models_ = BatteryModel.objects.filter(user=request.user)
-    return render(request, APPNAME + 'model_index.html', {'models': models_})
+    models_ = BatteryModel.objects.for_user(request.user).for_list()
+    # The page and the count are only queried when the template renders them (cached, see table_cache())
+    return render(request, APPNAME + 'model_index.html',
+                  {'page': paginate(request, models_), 'totals': SimpleLazyObject(models_.totals),
+                   'table_cache': table_cache(request, 'model')})
 
 
 @login_required
+@inventory_condition
 def model_detail(request, pk=None, create=True):
     # POST request = submission of a form which must be saved to DB
     if request.method == 'POST':
@@ -50,7 +59,7 @@ def model_detail(request, pk=None, create=True):
             # res = BatteryModel.objects.filter(user=request.user).get(pk=pk)
             # form = BatteryModelForm(initial=model_to_dict(res))  # populate the form based on the QuerySet
             # Method 2
-            res = get_object_or_404(BatteryModel, pk=pk, user=request.user)
+            res = get_object_or_404(BatteryModel.objects.for_user(request.user), pk=pk)
             form = BatteryModelForm(instance=res)
 
     # Hit if if method is GET
@@ -62,6 +71,6 @@ def model_detail(request, pk=None, create=True):
 def model_delete(request, pk):
     # POST request = delete assignment
     if request.method == 'POST':
-        model_ = get_object_or_404(BatteryModel, pk=pk, user=request.user)
+        model_ = get_object_or_404(BatteryModel.objects.for_user(request.user), pk=pk)
         model_.delete()
         return redirect('battery:model')
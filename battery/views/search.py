@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import render
+from django.urls import reverse
+
+from battery.models import SearchEntry
+from battery.search import search_results
+
+APPNAME = "battery/"
+
+#
+# full-text search of the inventory (see battery/search.py)
+#
+
+# kind of SearchEntry -> (label, name of the detail page)
+KIND_PAGES = {kind: (label, f'battery:{kind}_detail') for kind, label in SearchEntry.KINDS}
+
+
+@login_required
+def search(request):
+    # Battery types, battery models, devices and assignments of the user matching all the words of 'q',
+    # newest first
+    text = request.GET.get('q', '').strip()
+    results = []
+    if text:
+        for kind, instance in search_results(request.user, text, settings.BATTERY_SEARCH_RESULTS):
+            label, page = KIND_PAGES[kind]
+            results.append({'kind': label, 'url': reverse(page, args=[instance.pk]), 'instance': instance})
+    return render(request, APPNAME + 'search.html', {'q': text, 'results': results})
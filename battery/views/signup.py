@@ -1,5 +1,7 @@
 from allauth.account.views import SignupView
-from battery.models import BatteryType, BatteryModel
+from django.db import transaction
+
+from battery.seed import seed_user
 
 # Override the django-allauth SignupView to add a set of pre-defined BatteryType and BatteryModel when a new user
 #  is created
@@ -21,17 +23,14 @@ class AccountSignupView(SignupView):
     # def get_context_data(self, **kwargs):
     #     ...
     def form_valid(self, form):
-        # Call the parent's form_valid method
-        ret = SignupView.form_valid(self, form)
-
-        # Create pre-defined battery types for the new user
-        BatteryType(type='AA', description='', user=self.user).save()
-        BatteryType(type='AAA', description='', user=self.user).save()
-
-        # Create pre-defined battery models for the new user
-        BatteryModel(description='Non-Rechargeable', user=self.user).save()
-        BatteryModel(description='Rechargeable 1.2V', user=self.user).save()
-        BatteryModel(description='Rechargeable 1.5V', user=self.user).save()
+        # The user and its battery types and models (settings.BATTERY_SEED_DATA) are created in one transaction:
+        # one INSERT per model instead of one autocommit per row
+        with transaction.atomic():
+            # Call the parent's form_valid method
+            ret = SignupView.form_valid(self, form)
+
+            # Create pre-defined battery types and models for the new user
+            seed_user(self.user)
 
         # Return whatever was returned by the parent class
         return ret
@@ -0,0 +1,19 @@
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import render
+
+from battery.cache import get_summary
+from battery.conditional import inventory_condition
+
+APPNAME = "battery/"
+
+#
+# overview of the inventory
+#
+
+@login_required
+@inventory_condition
+def summary(request):
+    # Totals per battery type and battery model, and battery capacity of the devices per battery type
+    # Computed with one GROUP BY query per table and cached until the inventory of the user changes
+    # (see battery/cache.py)
+    return render(request, APPNAME + 'summary.html', {'summary': get_summary(request.user)})
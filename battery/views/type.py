@@ -1,7 +1,11 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
+from django.utils.functional import SimpleLazyObject
 
+from battery.cache import table_cache
+from battery.conditional import inventory_condition
 from battery.forms import *
+from battery.pagination import paginate
 
 APPNAME = "battery/"
 
@@ -10,12 +14,17 @@ APPNAME = "battery/"
 #
 
 @login_required
+@inventory_condition
 def type_index(request):
-    types = BatteryType.objects.filter(user=request.user)
-    return render(request, APPNAME + 'type_index.html', {'types': types})
+    types = BatteryType.objects.for_user(request.user).for_list()
+    # The page and the count are only queried when the template renders them (cached, see table_cache())
+    return render(request, APPNAME + 'type_index.html',
+                  {'page': paginate(request, types), 'totals': SimpleLazyObject(types.totals),
+                   'table_cache': table_cache(request, 'type')})
 
 
 @login_required
+@inventory_condition
 def type_detail(request, pk=None, create=True):
     # POST request = submission of a form which must be saved to DB
     if request.method == 'POST':
@@ -50,7 +59,7 @@ def type_detail(request, pk=None, create=True):
             # res = BatteryType.objects.filter(user=request.user).get(pk=pk)
             # form = BatteryTypeForm(initial=model_to_dict(res))  # populate the form based on the QuerySet
             # Method 2
-            res = get_object_or_404(BatteryType, pk=pk, user=request.user)
+            res = get_object_or_404(BatteryType.objects.for_user(request.user), pk=pk)
             form = BatteryTypeForm(instance=res)
 
     # Hit if if method is GET
@@ -62,6 +71,6 @@ def type_detail(request, pk=None, create=True):
 def type_delete(request, pk):
     # POST request = delete assignment
     if request.method == 'POST':
-        type_ = get_object_or_404(BatteryType, pk=pk, user=request.user)
+        type_ = get_object_or_404(BatteryType.objects.for_user(request.user), pk=pk)
         type_.delete()
         return redirect('battery:type')
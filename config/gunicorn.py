@@ -0,0 +1,42 @@
+# Configuration of gunicorn, the production server of the project (runserver is single-process, for development)
+#   gunicorn -c config/gunicorn.py config.wsgi
+# https://docs.gunicorn.org/en/stable/settings.html
+#
+# Every setting can be overridden with an environment variable (see docker-compose.prod.yml)
+#
+# Reloads:
+# - kill -HUP <master pid>: graceful restart of the workers (new settings, same code since the app is preloaded)
+# - kill -USR2 <master pid> then kill -TERM <old master pid>: upgrade to a new version of the code without
+#   dropping any request (a new master is started next to the old one)
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Workers: processes, each with its own DB connection per thread and its own local-memory cache
+# The views are mostly waiting for the DB: (2 x CPU) + 1 processes, each with a few threads
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+worker_class = 'gthread'
+
+# Load the Django application once in the master before forking the workers: fast forks, shared memory pages
+preload_app = True
+
+# Requests longer than 'timeout' seconds are killed; on a restart, workers finish their requests during
+# 'graceful_timeout' seconds
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# Restart the workers after a random nb of requests, to bound the memory they use
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # The DB connections must not be shared with the master: each worker opens its own
+    from django.db import connections
+    connections.close_all()
@@ -0,0 +1,34 @@
+#
+# Health checks of the persistent connections (CONN_MAX_AGE), for the databases with 'CONN_HEALTH_CHECKS' (the
+# setting of Django 4.1, which Django 3.1 ignores), used by the backend of config/postgresql_backend
+#
+# A connection which was closed by the database server or by a network failure since the previous request would
+# make the first query of the next request fail. As in Django 4.1, the connection is pinged the first time a request
+# uses it, and replaced when the ping fails. The requests which do not use the database (e.g., the static files)
+# do not ping it, and the later queries of the request are not checked again
+#
+
+
+class HealthChecksMixin:
+    health_check_done = False
+
+    def connect(self):
+        super().connect()
+        # A new connection does not need to be checked
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        # Called at the start and at the end of each request (close_old_connections()): the connection kept for the
+        # next request is checked when the request uses it
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        # Called before each query and when a transaction starts: the check is done outside of the transactions,
+        # a connection cannot be replaced in the middle of one
+        if (self.connection is not None and not self.health_check_done and not self.in_atomic_block
+                and self.settings_dict.get('CONN_HEALTH_CHECKS')):
+            if not self.is_usable():
+                self.close()
+            self.health_check_done = True
+        super().ensure_connection()
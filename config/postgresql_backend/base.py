@@ -0,0 +1,11 @@
+from django.db.backends.postgresql import base
+
+from config.health_checks import HealthChecksMixin
+
+#
+# PostgreSQL backend which supports 'CONN_HEALTH_CHECKS' (see config/health_checks.py and DATABASES in settings.py)
+#
+
+
+class DatabaseWrapper(HealthChecksMixin, base.DatabaseWrapper):
+    pass
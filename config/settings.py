@@ -1,15 +1,25 @@
+import os
 from pathlib import Path
 
+
+def env_bool(name, default):
+    # Boolean environment variable: 1/true/yes/on (case insensitive) are True
+    value = os.environ.get(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes', 'on')
+
+
 # GENERAL
 # ------------------------------------------------------------------------------
+# The settings can be set with environment variables (see docker-compose.yml): without any environment variable,
+# the settings are the ones of the development server (DEBUG, SQLite)
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 # https://docs.djangoproject.com/en/dev/ref/settings/#std:setting-SECRET_KEY
-SECRET_KEY = '43)%4yx)oiweufowieuraa@a=+_c(fn&kf3g29xax+=+a&key9i=!98zyim=8j'
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', '43)%4yx)oiweufowieuraa@a=+_c(fn&kf3g29xax+=+a&key9i=!98zyim=8j')
 # https://docs.djangoproject.com/en/dev/ref/settings/#debug
-DEBUG = True
+DEBUG = env_bool('DJANGO_DEBUG', True)
 # https://docs.djangoproject.com/en/dev/ref/settings/#allowed-hosts
-ALLOWED_HOSTS = ["localhost", "0.0.0.0", "127.0.0.1"]
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost,0.0.0.0,127.0.0.1').split(',')
 
 # APPS
 # ------------------------------------------------------------------------------
@@ -28,7 +38,6 @@ INSTALLED_APPS = [
     'allauth',
     'allauth.account',
     'crispy_forms',
-    'debug_toolbar',
 
     # Local
     'accounts',
@@ -42,11 +51,14 @@ INSTALLED_APPS = [
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#middleware
 MIDDLEWARE = [
+    # First, to measure the whole request (see battery/instrumentation.py)
+    'battery.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # Reads from the replica, if any (see battery/routers.py)
+    'battery.routers.PrimaryPinningMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -63,12 +75,18 @@ WSGI_APPLICATION = "config.wsgi.application"
 # TEMPLATES
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#templates
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django template backend which times the rendering of the templates (see battery/instrumentation.py)
+        'BACKEND': 'battery.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': ['templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Outside debug, the templates are compiled once per process and kept in memory (cached loader)
+            'loaders': TEMPLATE_LOADERS if DEBUG else [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -82,11 +100,112 @@ TEMPLATES = [
 # DATABASES
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#databases
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PostgreSQL when POSTGRES_HOST is set (e.g., the 'db' service of docker-compose.yml), SQLite otherwise
+if os.environ.get('POSTGRES_HOST'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'config.postgresql_backend',     # django.db.backends.postgresql with CONN_HEALTH_CHECKS
+            'NAME': os.environ.get('POSTGRES_DB', 'postgres'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ['POSTGRES_HOST'],
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Persistent connections: a connection is reused by the requests of a worker for CONN_MAX_AGE seconds
+            # instead of being opened (TCP + authentication) for each request
+            # https://docs.djangoproject.com/en/dev/ref/databases/#persistent-connections
+            'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 60)),
+            # Check that a persistent connection is still usable before reusing it: ping when a request first uses
+            # it (see config/health_checks.py, Django 3.1 ignores this setting)
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get('POSTGRES_REPLICA_HOST'):
+        DATABASES['replica'] = {**DATABASES['default'], 'HOST': os.environ['POSTGRES_REPLICA_HOST']}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_SQLITE_NAME', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+    # SQLite with several worker processes (e.g., gunicorn): WAL journal, busy timeout and transactions which take
+    # the write lock first, so that concurrent writes wait instead of failing with "database is locked"
+    # (see config/sqlite_backend/base.py and "python manage.py sqlite_write_benchmark")
+    if env_bool('DJANGO_SQLITE_CONCURRENT', False):
+        DATABASES['default']['ENGINE'] = 'config.sqlite_backend'
+    # Stand-in for a replica in local tests: a copy of the DB file
+    if os.environ.get('DJANGO_SQLITE_REPLICA_NAME'):
+        DATABASES['replica'] = {**DATABASES['default'], 'NAME': os.environ['DJANGO_SQLITE_REPLICA_NAME']}
+
+# Read replica (POSTGRES_REPLICA_HOST or DJANGO_SQLITE_REPLICA_NAME): the GET requests read the battery tables from
+# it (see battery/routers.py). The tests use the primary in its place
+if 'replica' in DATABASES:
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['battery.routers.ReplicaRouter']
+
+# CACHES
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/ref/settings/#caches
+# DJANGO_CACHE_BACKEND selects the cache:
+# - 'locmem' (default): private to each process, for a single process (runserver, tests)
+# - 'db': table of the DB, shared by the worker processes (create it with "python manage.py createcachetable")
+# - 'memcached': memcached server(s) at DJANGO_CACHE_LOCATION (e.g., 'memcached:11211'), shared by the worker
+#   processes, requires python-memcached
+# With several worker processes (gunicorn), the cache must be shared: the invalidations of the cached choices,
+# summary and tables done by one worker must be seen by the others
+CACHE_BACKEND = os.environ.get('DJANGO_CACHE_BACKEND', 'locmem')
+if CACHE_BACKEND == 'db':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'battery_cache',
+        }
     }
+elif CACHE_BACKEND == 'memcached':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', '127.0.0.1:11211').split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'battery',
+        }
+    }
+
+# SESSIONS
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/topics/http/sessions/#using-cached-sessions
+# With a shared cache, the session of each request is read from the cache, the DB is only read when the session is
+# not in the cache. The local-memory cache would keep in each process its own copy of the sessions (e.g., still
+# logged in after a logout handled by another worker): the sessions are then read from the DB
+if CACHE_BACKEND == 'locmem':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# LOGGING
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/topics/logging/
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # One line per instrumented request (see BATTERY_INSTRUMENTATION)
+        'battery.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
 # PASSWORDS
@@ -147,6 +266,11 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # https://django-debug-toolbar.readthedocs.io/en/latest/installation.html
 # https://docs.djangoproject.com/en/dev/ref/settings/#internal-ips
 INTERNAL_IPS = ['127.0.0.1']
+# The debug toolbar is only installed in debug: it instruments every request
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.common.CommonMiddleware') + 1,
+                      'debug_toolbar.middleware.DebugToolbarMiddleware')
 
 # CUSTOM USER MODEL CONFIGS
 # ------------------------------------------------------------------------------
@@ -176,3 +300,48 @@ ACCOUNT_UNIQUE_EMAIL = True
 
 # Disable SignUp
 #ACCOUNT_ADAPTER = 'accounts.adapter.NoNewUsersAccountAdapter'
+
+# BATTERY CONFIGS
+# ------------------------------------------------------------------------------
+# Default and maximum nb of rows per page in the index pages (keyset pagination, see battery/pagination.py)
+BATTERY_PAGE_SIZE = 50
+BATTERY_MAX_PAGE_SIZE = 500
+# Page sizes proposed in the index pages
+BATTERY_PAGE_SIZE_CHOICES = (25, 50, 100, 500)
+# Nb of rows read from the DB at once when exporting the inventory
+BATTERY_EXPORT_CHUNK_SIZE = 2000
+# Time in seconds the choices of the forms are cached (evicted when battery types, models or devices change)
+BATTERY_CHOICES_CACHE_TIMEOUT = 60 * 60
+# Time in seconds the overview of the inventory is cached (evicted when the inventory changes)
+BATTERY_SUMMARY_CACHE_TIMEOUT = 60 * 60
+# Time in seconds the tables of the index pages are cached (a new version is cached when the inventory changes)
+BATTERY_TABLE_CACHE_TIMEOUT = 10 * 60
+# Nb of matches returned by the typeahead of the device and battery model fields of the forms
+BATTERY_TYPEAHEAD_SIZE = 10
+# Nb of results of the full-text search of the inventory (newest first)
+BATTERY_SEARCH_RESULTS = 50
+# After a write, the reads of the client go to the primary during this time (seconds), longer than the replication lag
+BATTERY_REPLICA_STICKY_SECONDS = 10
+# Battery types and battery models created for each new user (see battery/seed.py)
+# Existing users are seeded with: python manage.py seed_users
+BATTERY_SEED_DATA = {
+    'types': [
+        {'type': 'AA', 'description': ''},
+        {'type': 'AAA', 'description': ''},
+    ],
+    'models': [
+        {'description': 'Non-Rechargeable'},
+        {'description': 'Rechargeable 1.2V'},
+        {'description': 'Rechargeable 1.5V'},
+    ],
+}
+# Instrumentation of the requests (see battery/instrumentation.py)
+# SAMPLE_RATE: fraction of the requests which are instrumented (0 to disable, 1 for all the requests), disabled by
+# default (development server, tests) and set with BATTERY_INSTRUMENTATION_SAMPLE_RATE in production
+# QUERY_THRESHOLD: the requests which run more SQL queries are logged as warnings (e.g., N+1 queries)
+# SERVER_TIMING: add the 'Server-Timing' header to the instrumented responses
+BATTERY_INSTRUMENTATION = {
+    'SAMPLE_RATE': float(os.environ.get('BATTERY_INSTRUMENTATION_SAMPLE_RATE', 0)),
+    'QUERY_THRESHOLD': 20,
+    'SERVER_TIMING': True,
+}
@@ -0,0 +1,41 @@
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3 import base
+from django.dispatch import receiver
+
+#
+# SQLite backend for several worker processes writing to the same DB (opt-in, see DATABASES in settings.py)
+#
+# With the stock backend, a transaction starts with a deferred BEGIN: it reads the DB (e.g., the capacity of a
+# device) then needs the write lock to save. When another process holds the write lock, SQLite cannot wait for it
+# (the transaction would write from an outdated snapshot) and fails at once with "database is locked".
+# This backend:
+# - starts the transactions (atomic blocks) with BEGIN IMMEDIATE: the write lock is taken first, so the writers
+#   queue on the busy timeout instead of failing
+# - applies PRAGMAs to each new connection: WAL journal (the readers do not block the writer and the writer does
+#   not block the readers), synchronous=NORMAL (no fsync on each commit in WAL mode, the DB stays consistent),
+#   busy timeout, memory-mapped I/O and page cache
+# The PRAGMAs can be overridden with the 'PRAGMAS' key of the DATABASES entry
+#
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,           # milliseconds
+    'mmap_size': 256 * 1024 * 1024,  # bytes
+    'cache_size': -20000,           # negative: KiB, i.e. 20 MB per connection
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def _start_transaction_under_autocommit(self):
+        # Take the write lock when the transaction starts (the stock backend runs a deferred BEGIN)
+        self.cursor().execute('BEGIN IMMEDIATE')
+
+
+@receiver(connection_created, sender=DatabaseWrapper)
+def apply_pragmas(sender, connection, **kwargs):
+    pragmas = {**DEFAULT_PRAGMAS, **connection.settings_dict.get('PRAGMAS', {})}
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -1,3 +1,72 @@
-from django.test import TestCase
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.db import connections
+from django.db.backends.sqlite3 import base as sqlite3
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from config.health_checks import HealthChecksMixin
+
+
+class ReadyTests(TestCase):
+    databases = '__all__'   # the replica too, when configured
+
+    def test_ready(self):
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['checks']['database:default'], 'ok')
+        self.assertEqual(response.json()['checks']['cache'], 'ok')
+
+    def test_errors_are_logged_not_returned(self):
+        with mock.patch('pages.views.cache.set', side_effect=ConnectionError('memcached at 10.0.0.5:11211')), \
+                self.assertLogs('pages.views', 'ERROR') as logs:
+            response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['checks']['cache'], 'error')
+        self.assertNotIn('10.0.0.5', response.content.decode())
+        self.assertIn('10.0.0.5', logs.output[0])
+
+
+class ConnectionHealthCheckTests(SimpleTestCase):
+
+    class DatabaseWrapper(HealthChecksMixin, sqlite3.DatabaseWrapper):
+        pass
+
+    def connection(self, health_checks=True):
+        # Persistent connection to a temporary SQLite DB (the in-memory DBs are never closed)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = {**connections['default'].settings_dict, 'NAME': os.path.join(directory.name, 'db.sqlite3'),
+                         'CONN_MAX_AGE': None, 'CONN_HEALTH_CHECKS': health_checks}
+        connection = self.DatabaseWrapper(settings_dict)
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_connection_is_checked_on_its_first_use_by_a_request(self):
+        connection = self.connection()
+        connection.cursor()
+        with mock.patch.object(connection, 'is_usable', return_value=False) as is_usable:
+            connection.cursor()                         # new connection: not checked
+            connection.close_if_unusable_or_obsolete()  # start of the next request: no ping
+            is_usable.assert_not_called()
+            broken = connection.connection
+            connection.cursor()                         # first query of the request: ping, then reconnection
+            self.assertIsNot(connection.connection, broken)
+            connection.close_if_unusable_or_obsolete()
+            is_usable.reset_mock()
+            is_usable.return_value = True
+            connection.cursor()
+            connection.cursor()                         # checked once per request
+            is_usable.assert_called_once_with()
+
+    def test_connection_is_not_checked_in_a_transaction_or_without_the_setting(self):
+        for connection, atomic in ((self.connection(), True), (self.connection(health_checks=False), False)):
+            connection.cursor()
+            connection.close_if_unusable_or_obsolete()
+            with mock.patch.object(connection, 'is_usable', return_value=False) as is_usable:
+                connection.in_atomic_block = atomic
+                connection.cursor()
+                connection.in_atomic_block = False
+                is_usable.assert_not_called()
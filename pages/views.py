@@ -1,9 +1,44 @@
+import logging
+
+from django.core.cache import cache
+from django.db import connections, DatabaseError
+from django.http import JsonResponse
 from django.views.generic import TemplateView
 
+logger = logging.getLogger(__name__)
+
 
 class HomePageView(TemplateView):
     template_name = 'pages/home.html'
 
 
 class AboutPageView(TemplateView):
-    template_name = 'pages/about.html'
\ No newline at end of file
+    template_name = 'pages/about.html'
+
+
+def ready(request):
+    # Readiness endpoint for the load balancers and the orchestrators (see config/gunicorn.py):
+    # 200 when the databases and the cache can be used, 503 otherwise
+    # The endpoint is public: the errors are logged, the response only says which check failed
+    checks = {}
+    for connection in connections.all():
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            checks[f'database:{connection.alias}'] = 'ok'
+        except DatabaseError:
+            logger.exception('Readiness check of the database %s failed', connection.alias)
+            checks[f'database:{connection.alias}'] = 'error'
+    try:
+        cache.set('ready', 1, 10)
+        if cache.get('ready') == 1:
+            checks['cache'] = 'ok'
+        else:
+            logger.error('Readiness check of the cache failed: the value set was not read back')
+            checks['cache'] = 'error'
+    except Exception:  # the errors of the cache backends do not share a base class
+        logger.exception('Readiness check of the cache failed')
+        checks['cache'] = 'error'
+
+    ready = all(status == 'ok' for status in checks.values())
+    return JsonResponse({'ready': ready, 'checks': checks}, status=200 if ready else 503)
@@ -0,0 +1,48 @@
+// Typeahead of the <select> rendered by battery.forms.TypeaheadSelect
+// A search box is added above the <select>: as the user types, the options are replaced by the matches returned
+// by the JSON API (data-typeahead-url), and the first match is selected
+document.querySelectorAll('select[data-typeahead-url]').forEach(function (select) {
+  var input = document.createElement('input');
+  input.type = 'search';
+  input.className = 'form-control mb-1';
+  input.placeholder = 'Type to search';
+  input.autocomplete = 'off';
+  select.parentNode.insertBefore(input, select);
+
+  var timer = null;
+  var controller = null;
+
+  function search() {
+    if (controller) {
+      controller.abort();   // only the matches of the last text are shown
+    }
+    controller = new AbortController();
+    fetch(select.dataset.typeaheadUrl + '?q=' + encodeURIComponent(input.value),
+          {credentials: 'same-origin', signal: controller.signal})
+      .then(function (response) { return response.json(); })
+      .then(function (data) {
+        // Keep the empty option and the selected one, replace the others by the matches
+        var selected = select.value;
+        Array.from(select.options).forEach(function (option) {
+          if (option.value && option.value !== selected) {
+            option.remove();
+          }
+        });
+        data.results.forEach(function (result) {
+          if (String(result.id) !== selected) {
+            select.add(new Option(result.label, result.id));
+          }
+        });
+        if (input.value && data.results.length) {
+          select.value = data.results[0].id;
+        }
+      })
+      .catch(function () {});   // aborted, or network error: the options are unchanged
+  }
+
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(search, 200);   // one request once the user pauses typing
+  });
+  input.addEventListener('focus', search, {once: true});   // first matches before typing
+});